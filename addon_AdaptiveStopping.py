@@ -0,0 +1,100 @@
+import math
+import time
+
+import pandas as pd
+from scipy import stats
+
+# Vehicle classes whose energy savings (baseline minus hybrid, kWh) decide when a study has converged
+VEHICLE_CLASSES = ['Diesel Truck', 'EV Truck', 'EV Van']
+
+class RunningStats:
+    '''
+    Running mean and sample variance of a series (Welford's algorithm), updated one value at a time
+    '''
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self._m2 / (self.n - 1) if self.n > 1 else math.nan
+
+    def interval(self, confidence=0.95):
+        '''
+        Returns the Student t confidence interval (low, high) of the mean, or (nan, nan) with fewer than two values
+        '''
+        if self.n < 2:
+            return math.nan, math.nan
+        half_width = stats.t.ppf(0.5 + confidence / 2, self.n - 1) * math.sqrt(self.variance / self.n)
+        return self.mean - half_width, self.mean + half_width
+
+class StoppingRule:
+    '''
+    Decides when a Monte Carlo study has run enough instances
+    Keeps running statistics of the savings of the hybrid scenario for every vehicle class, and stops the study once
+    every confidence interval is narrower than ci_width times its mean saving (e.g. 0.1 for +/- 5%, after at least min_instances),
+    once max_instances instances are recorded, or once time_budget seconds have passed since the rule was created
+    '''
+    def __init__(self, ci_width=0.1, confidence=0.95, min_instances=5, max_instances=None, time_budget=None):
+        self.ci_width = ci_width
+        self.confidence = confidence
+        self.min_instances = max(min_instances, 2)
+        self.max_instances = max_instances
+        self.time_budget = time_budget
+        self.savings = {vehicle: RunningStats() for vehicle in VEHICLE_CLASSES}
+        self.start_time = time.time()
+        # 'converged', 'max_instances' or 'time_budget' once should_stop() returned True
+        self.reason = None
+
+    @property
+    def n(self):
+        return self.savings[VEHICLE_CLASSES[0]].n
+
+    def update(self, result):
+        # result: an instance result (dict or row) with the columns of RESULT_COLUMNS
+        for vehicle, running in self.savings.items():
+            running.update(result['Baseline (%s)' % vehicle] - result['Hybrid (%s)' % vehicle])
+
+    def converged(self):
+        if self.n < self.min_instances:
+            return False
+        for running in self.savings.values():
+            low, high = running.interval(self.confidence)
+            if not high - low <= self.ci_width * abs(running.mean):
+                return False
+        return True
+
+    def should_stop(self):
+        if self.reason is None:
+            if self.converged():
+                self.reason = 'converged'
+            elif self.max_instances is not None and self.n >= self.max_instances:
+                self.reason = 'max_instances'
+            elif self.time_budget is not None and time.time() - self.start_time >= self.time_budget:
+                self.reason = 'time_budget'
+        return self.reason is not None
+
+    def intervals(self):
+        '''
+        Returns a DataFrame with the number of instances, the mean saving (kWh), its confidence interval and the interval width
+        relative to the mean for every vehicle class
+        '''
+        rows = []
+        for vehicle, running in self.savings.items():
+            low, high = running.interval(self.confidence)
+            rows.append({
+                'vehicle': vehicle,
+                'instances': running.n,
+                'mean_saving': round(running.mean, 4),
+                'ci_low': round(low, 4),
+                'ci_high': round(high, 4),
+                'relative_width': round((high - low) / abs(running.mean), 4) if running.mean else math.nan,
+            })
+        return pd.DataFrame(rows).set_index('vehicle')
@@ -0,0 +1,309 @@
+# https://github.com/sgbaik-decaf/TruckDroneEnergySimulator
+
+#_________________________[DISCLAIMER]_______________________
+
+# Offline benchmark of the simulation pipeline on synthetic road networks (no OpenStreetMap or Nominatim access needed).
+# Each case builds a grid or random planar drive graph, then times SimulateCustomers (sampling, snapping, travel matrix),
+# the energy modules and SolveGreedyTSP for a number of customers, and reports throughput and memory.
+# The mFSTSP heuristic needs Gurobi, so the energy modules are fed a stand-in truck-drone plan (see StandInPlan).
+
+# python addon_Benchmark.py                      run the suite and compare it against Benchmarks/baseline.json
+# python addon_Benchmark.py --save-baseline      run the suite and store it as the new baseline
+# python addon_Benchmark.py --quick              a smaller suite for CI
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import osmnx as ox
+from scipy.spatial import Delaunay
+
+from addon_GraphArrays import EDGE_WEIGHTS, GraphWeightsCSR, ShortestPathMatrix
+from addon_OSMnxGeospatialSimulator import SimulateCustomers, GetCustomerSampler, _BoxSubgraph, _time_and_length_tree
+from addon_EnergyConsumptionCalculator import runDroneEnergyModule, runTruckEnergyModule
+from addon_GreedyGroundTSP import SolveGreedyTSP, BuildTourMatrices, NearestNeighbourTours
+from addon_HaversineFunction import haversine_array
+from addon_Instrumentation import Recording, Span
+
+# Synthetic networks are centered on Pittsburgh, PA
+BENCHMARK_CENTER = (40.4406, -79.9959)
+METERS_PER_DEG_LAT = 111320.0
+
+# Edge speeds are drawn from typical urban speed limits (25, 30 and 35 mph)
+BENCHMARK_SPEEDS_KPH = (40.2, 48.3, 56.3)
+
+# Same values as Problems/tbl_vehicles_999.csv, so the suite runs without the Problems folder
+BENCHMARK_VEHICLES = pd.DataFrame(
+    [[1, 1, -1, -1, -1, -1, -1, -1, -1, -1, 30, -1, 'NA']] + [[k, 2, 5, 12, 4, 360, 50, 1.11, 60, 120, 60, 359640, 'low'] for k in range(2, 6)],
+    columns=['% vehicleID', 'vehicleType', 'takeoffSpeed [m/s]', 'cruiseSpeed [m/s]', 'landingSpeed [m/s]', 'yawRateDeg [deg/sec]', 'cruiseAlt [m]',
+             'capacity [lbs]', 'launchTime [sec]', 'recoveryTime [sec]', 'serviceTime [sec]', 'batteryPower [Joule]', 'range'])
+
+BaselineInformation = {'Diesel Truck':2665.69, 'EV Truck':621.37, 'EV Van':347.97}
+
+# (graph kind, approximate number of nodes) x customers per instance
+BENCHMARK_GRAPHS = [('grid', 900), ('grid', 3600), ('planar', 2000), ('planar', 8000)]
+BENCHMARK_CUSTOMERS = [10, 50, 100, 300]
+QUICK_GRAPHS = [('grid', 900), ('planar', 2000)]
+QUICK_CUSTOMERS = [10, 50]
+
+# The routing check compares both backends on a network beyond 46,340 nodes, where node index pairs no longer fit in int32
+CHECK_GRAPH_NODES = 50000
+CHECK_ORIGINS = 10
+CHECK_TOLERANCE = 1e-6 # (s) and (m)
+
+# Per-instance stages reported for every case
+BENCHMARK_STAGES = ['sample_customers', 'travel_matrix', 'stand_in_plan', 'energy_modules', 'baseline_tsp']
+
+def _DriveGraph(lat, lon, edges, seed=0):
+    '''
+    Builds a two-way drive MultiDiGraph in the layout of ox.graph_from_point, with length, speed_kph and travel_time on every edge
+    '''
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph(crs='EPSG:4326', city_center=BENCHMARK_CENTER, edge_weights=EDGE_WEIGHTS)
+    nodes = np.arange(len(lat)) + 1
+    for node, y, x in zip(nodes.tolist(), lat.tolist(), lon.tolist()):
+        G.add_node(node, y=y, x=x, street_count=0)
+    u, v = edges[:, 0], edges[:, 1]
+    length = haversine_array(lat[u], lon[u], lat[v], lon[v]) * 1000 # (km) -> (m)
+    speed = rng.choice(BENCHMARK_SPEEDS_KPH, size=len(edges))
+    for k, (a, b) in enumerate(edges.tolist()):
+        data = {'osmid': k + 1, 'highway': 'residential', 'oneway': False, 'length': float(length[k]),
+                'speed_kph': float(speed[k]), 'travel_time': float(length[k] / (speed[k] / 3.6))}
+        G.add_edge(int(nodes[a]), int(nodes[b]), reversed=False, **data)
+        G.add_edge(int(nodes[b]), int(nodes[a]), reversed=True, **data)
+    for node, degree in G.out_degree():
+        G.nodes[node]['street_count'] = degree
+    return G
+
+def _MetersToDegrees(north, east):
+    return (BENCHMARK_CENTER[0] + north / METERS_PER_DEG_LAT,
+            BENCHMARK_CENTER[1] + east / (METERS_PER_DEG_LAT * np.cos(np.radians(BENCHMARK_CENTER[0]))))
+
+def SyntheticGridGraph(num_nodes, spacing=150.0, seed=0):
+    '''
+    Square street grid of about num_nodes intersections, spacing meters apart
+    '''
+    side = int(round(np.sqrt(num_nodes)))
+    north, east = np.meshgrid(np.arange(side) * spacing, np.arange(side) * spacing, indexing='ij')
+    lat, lon = _MetersToDegrees((north - north.mean()).ravel(), (east - east.mean()).ravel())
+    index = np.arange(side * side).reshape(side, side)
+    edges = np.concatenate([
+        np.stack([index[:, :-1].ravel(), index[:, 1:].ravel()], axis=1),
+        np.stack([index[:-1, :].ravel(), index[1:, :].ravel()], axis=1)])
+    return _DriveGraph(lat, lon, edges, seed)
+
+def SyntheticPlanarGraph(num_nodes, spacing=150.0, seed=0):
+    '''
+    Random planar street network: uniform random intersections joined by their Delaunay triangulation
+    Intersections are spread over the same area as a grid with the same number of nodes
+    '''
+    rng = np.random.default_rng(seed)
+    extent = np.sqrt(num_nodes) * spacing
+    points = rng.uniform(-extent / 2, extent / 2, size=(num_nodes, 2))
+    simplices = Delaunay(points).simplices
+    edges = np.concatenate([simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [0, 2]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    lat, lon = _MetersToDegrees(points[:, 0], points[:, 1])
+    return _DriveGraph(lat, lon, edges, seed)
+
+SYNTHETIC_GRAPHS = {'grid': SyntheticGridGraph, 'planar': SyntheticPlanarGraph}
+
+def StandInPlan(problem, matrix_DF_copy):
+    '''
+    Returns (UAV_DF, Truck_DF) in the layout of missionControl.return_solution(), without the mFSTSP heuristic:
+    the truck follows a nearest-neighbour tour, and every second light parcel on it is flown by a UAV
+    launched from the previous truck stop and recovered at the next one
+    '''
+    time_matrix, _ = BuildTourMatrices(matrix_DF_copy)
+    tour = NearestNeighbourTours(time_matrix, starts=[0])[0]
+    capacity = BENCHMARK_VEHICLES['capacity [lbs]'].iloc[-1]
+    droned = np.zeros(len(tour), dtype=bool)
+    droned[2:-1:2] = problem.parcelWtLbs[tour[2:-1:2]] <= capacity
+    truck_stops = tour[~droned]
+
+    launch = tour[np.flatnonzero(droned) - 1]
+    customer = tour[droned]
+    recover = tour[np.flatnonzero(droned) + 1]
+    legs = np.stack([np.stack([launch, customer], axis=1), np.stack([customer, recover], axis=1)], axis=1).reshape(-1, 2)
+    UAV_DF = pd.DataFrame({
+        'startNode': legs[:, 0],
+        'endNode': legs[:, 1],
+        'euclid_dist': haversine_array(problem.latDeg[legs[:, 0]], problem.lonDeg[legs[:, 0]], problem.latDeg[legs[:, 1]], problem.lonDeg[legs[:, 1]]),
+        'Description': ['UAV delivers parcel to node %d' % c if k % 2 == 0 else 'Return to truck at node %d' % c
+                        for k, c in enumerate(legs[:, 1].tolist())],
+    })
+    Truck_DF = pd.DataFrame({
+        'startNode': truck_stops[:-1],
+        'endNode': truck_stops[1:],
+        'Description': ['Truck travels from node %d to node %d' % (a, b) for a, b in zip(truck_stops[:-1].tolist(), truck_stops[1:].tolist())],
+    })
+    return UAV_DF, Truck_DF
+
+def CheckRoutingBackends(num_nodes=CHECK_GRAPH_NODES, num_origins=CHECK_ORIGINS, seed=0):
+    '''
+    Routes num_origins random nodes of a planar network to each other with the CSR arrays and with the NetworkX graph
+    Returns the largest difference in travel time (s) and in route length (m)
+    '''
+    G = SyntheticPlanarGraph(num_nodes, seed=seed)
+    nodes = np.random.default_rng(seed).choice(np.fromiter(G.nodes, dtype=np.int64, count=num_nodes), num_origins, replace=False).tolist()
+    time_csr, length_csr = ShortestPathMatrix(GraphWeightsCSR(G, 'travel_time'), nodes, nodes)
+    time_diff = length_diff = 0.0
+    for a, orig in enumerate(nodes):
+        tree = _time_and_length_tree(G, orig, nodes)
+        time_nx, length_nx = np.array([tree[dest] for dest in nodes]).T
+        time_diff = max(time_diff, float(np.max(np.abs(time_csr[a] - time_nx))))
+        length_diff = max(length_diff, float(np.max(np.abs(length_csr[a] - length_nx))))
+    return time_diff, length_diff
+
+def RunBenchmarkCase(kind, num_nodes, NumCustomers, repeats=5, seed=0, RoutingBackend='csr'):
+    '''
+    Times repeats instances on one synthetic graph and returns a dict of throughput, median stage times (s) and memory (MB)
+    Building the graph, its customer regions and routing arrays is timed once, as setup_s
+    '''
+    setup_start = time.perf_counter()
+    G = SYNTHETIC_GRAPHS[kind](num_nodes, seed=seed)
+    Gp = ox.project_graph(G)
+    # Customer regions as in BuildBoxGraph with BBOX at 40% of the network's half-width and CC = 0.5
+    half_width = np.sqrt(num_nodes) * 150.0 / 2
+    Gp_cust = _BoxSubgraph(G, Gp, BENCHMARK_CENTER, 0.8 * half_width, 'view')
+    Gp_cust_mini = _BoxSubgraph(G, Gp, BENCHMARK_CENTER, 0.4 * half_width, 'view')
+    GetCustomerSampler(Gp, Gp_cust, Gp_cust_mini)
+    if RoutingBackend == 'csr':
+        GraphWeightsCSR(G, 'travel_time')
+    setup_time = time.perf_counter() - setup_start
+
+    records = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        with Recording() as recorder:
+            matrix_DF_copy, problem = SimulateCustomers('benchmark', BENCHMARK_CENTER, G, Gp, Gp_cust, Gp_cust_mini,
+                                                        ExportCSV=False, ReturnProblem=True, RoutingBackend=RoutingBackend,
+                                                        seed=[seed, repeat], NumCustomers=NumCustomers)
+            with Span('stand_in_plan'):
+                sorties, truck_tour = StandInPlan(problem, matrix_DF_copy)
+            with Span('energy_modules'):
+                runDroneEnergyModule(sorties, BENCHMARK_VEHICLES)
+                runTruckEnergyModule(truck_tour, matrix_DF_copy, BaselineInformation)
+            with Span('baseline_tsp'):
+                SolveGreedyTSP(matrix_DF_copy)
+        record = recorder.record()
+        record['instance'] = time.perf_counter() - start
+        records.append(record)
+
+    records = pd.DataFrame(records)
+    result = {
+        'graph_nodes': G.number_of_nodes(),
+        'graph_edges': G.number_of_edges(),
+        'customers': NumCustomers,
+        'repeats': repeats,
+        'setup_s': round(setup_time, 4),
+        # Throughput from the median instance, so one slow instance on a busy machine does not flag a regression
+        'instances_per_s': round(1 / records['instance'].median(), 4),
+        'median_instance_s': round(records['instance'].median(), 4),
+    }
+    for stage in BENCHMARK_STAGES:
+        result['median_%s_s' % stage] = round(records['time_%s' % stage].median(), 4)
+    # Largest peak of the process while an instance ran (None where the platform does not report it)
+    result['peak_rss_mb'] = None if records['peak_rss_mb'].isna().all() else float(records['peak_rss_mb'].max())
+    return result
+
+def RunBenchmarkSuite(graphs=BENCHMARK_GRAPHS, customers=BENCHMARK_CUSTOMERS, repeats=5, seed=0, RoutingBackend='csr'):
+    '''
+    Runs every (graph, customers) case, smallest first, and returns {case name: result of RunBenchmarkCase}
+    '''
+    results = {}
+    for kind, num_nodes in sorted(graphs, key=lambda graph: graph[1]):
+        for NumCustomers in sorted(customers):
+            name = '%s%d_c%d' % (kind, num_nodes, NumCustomers)
+            results[name] = RunBenchmarkCase(kind, num_nodes, NumCustomers, repeats=repeats, seed=seed, RoutingBackend=RoutingBackend)
+            print('{:<20s}{:>10.2f} inst/s {:>10.4f} s/inst {:>10.1f} MB'.format(
+                name, results[name]['instances_per_s'], results[name]['median_instance_s'], results[name]['peak_rss_mb'] or float('nan')), flush=True)
+    return results
+
+def CompareToBaseline(results, baseline, tolerance=0.25):
+    '''
+    Returns a list of regression messages: cases whose throughput fell, or whose peak memory grew, by more than tolerance
+    Cases missing from either side are not compared
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]
+        if result['instances_per_s'] < reference['instances_per_s'] * (1 - tolerance):
+            regressions.append('%s: throughput %.2f inst/s, baseline %.2f inst/s' % (name, result['instances_per_s'], reference['instances_per_s']))
+        if result['peak_rss_mb'] and reference.get('peak_rss_mb') and result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+            regressions.append('%s: peak memory %.1f MB, baseline %.1f MB' % (name, result['peak_rss_mb'], reference['peak_rss_mb']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the simulation pipeline on synthetic road networks.')
+    parser.add_argument('--baseline', default='Benchmarks/baseline.json', help='stored baseline to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline instead of comparing')
+    parser.add_argument('--output', help='also save this run as JSON')
+    parser.add_argument('--quick', action='store_true', help='smaller graphs and customer counts')
+    parser.add_argument('--customers', type=int, nargs='+', help='customer counts (default: %s)' % BENCHMARK_CUSTOMERS)
+    parser.add_argument('--repeats', type=int, default=5, help='instances per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--routing-backend', dest='routing_backend', default='csr', choices=['csr', 'networkx'])
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown or memory growth')
+    parser.add_argument('--skip-routing-check', dest='skip_routing_check', action='store_true',
+                        help='do not compare the routing backends on a %d-node network first' % CHECK_GRAPH_NODES)
+    args = parser.parse_args(argv)
+
+    if not args.skip_routing_check:
+        time_diff, length_diff = CheckRoutingBackends()
+        if max(time_diff, length_diff) > CHECK_TOLERANCE:
+            print('[ REGRESSION ] csr and networkx routes differ on %d nodes: up to %g s and %g m' % (CHECK_GRAPH_NODES, time_diff, length_diff))
+            return 1
+        print('Routing check on %d nodes passed (csr and networkx agree within %g s and %g m).' % (CHECK_GRAPH_NODES, time_diff, length_diff), flush=True)
+
+    graphs = QUICK_GRAPHS if args.quick else BENCHMARK_GRAPHS
+    customers = args.customers or (QUICK_CUSTOMERS if args.quick else BENCHMARK_CUSTOMERS)
+    results = RunBenchmarkSuite(graphs, customers, repeats=args.repeats, seed=args.seed, RoutingBackend=args.routing_backend)
+    run = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'numpy': np.__version__,
+            'networkx': nx.__version__,
+            'osmnx': ox.__version__,
+            'routing_backend': args.routing_backend,
+            'repeats': args.repeats,
+        },
+        'cases': results,
+    }
+    paths = [args.output] if args.output else []
+    if args.save_baseline:
+        paths.append(args.baseline)
+    for path in paths:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.save_baseline:
+        print('Baseline saved as "%s".' % args.baseline)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print('No baseline at "%s"; run with --save-baseline to create one.' % args.baseline)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)['cases']
+    regressions = CompareToBaseline(results, baseline, tolerance=args.tolerance)
+    for regression in regressions:
+        print('[ REGRESSION ] %s' % regression)
+    if regressions:
+        return 1
+    print('No regressions against "%s" (tolerance %d%%).' % (args.baseline, args.tolerance * 100))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,91 +1,135 @@
+import numpy as np
 import pandas as pd
 import osmnx as ox
 
+# pre-fitted values from Rodrigues et al. (2022)
+RODRIGUES_COEFFICIENTS = {
+    'beta_1_TO': 80.4, # no unit
+    'beta_0_TO': 13.8, # no unit
+    'beta_1_CRZ': 68.9, # no unit
+    'beta_0_CRZ': 16.8, # no unit
+    'beta_1_LND': 71.5, # no unit
+    'beta_0_LND': -24.3, # no unit
+    }
+DRONE_MASS = 2.4 # (kg), assumed
+PARCEL_MASS = 0.5 # (kg), assumed
+AIR_DENSITY = 1.225 # at sea level (kg/m^3)
+
+def DroneEnergyKernel(parcel, CRZ_time, TO_time, LND_time, dronemass=DRONE_MASS, parcelmass=PARCEL_MASS, ro=AIR_DENSITY, coefficients=RODRIGUES_COEFFICIENTS):
+    '''
+    Returns (energy_takeoff, energy_cruise, energy_land) in J for whole arrays of sorties
+    parcel is True where the UAV carries a parcel, phase times are in s
+    '''
+    mass = np.where(parcel, dronemass + parcelmass, dronemass)
+    mass_term = mass**1.5 / ro**0.5
+    energy_takeoff = (coefficients['beta_1_TO'] * mass_term + coefficients['beta_0_TO']) * TO_time
+    energy_cruise = (coefficients['beta_1_CRZ'] * mass_term + coefficients['beta_0_CRZ']) * CRZ_time
+    energy_land = (coefficients['beta_1_LND'] * mass_term + coefficients['beta_0_LND']) * LND_time
+    return energy_takeoff, energy_cruise, energy_land
+
 def runDroneEnergyModule(sorties, UAV_info):
     # create an indicator whether the parcel is onboard or not
-    new_description_column = []
-    for row in sorties['Description']:
-        if 'UAV' in row:
-            new_description_column.append('parcel')
-        elif 'truck' in row:
-            new_description_column.append('nothing')
-        elif 'depot' in row:
-            new_description_column.append('nothing')
-    sorties['Description'] = pd.Series(new_description_column)
-    
-    # pre-fitted values from Rodrigues et al. (2022)
-    beta_1_TO = 80.4 # no unit
-    beta_0_TO = 13.8 # no unit
-    beta_1_CRZ = 68.9 # no unit
-    beta_0_CRZ = 16.8 # no unit
-    beta_1_LND = 71.5 # no unit
-    beta_0_LND = -24.3 # no unit
-    dronemass = 2.4 # (kg), assumed
-    parcelmass = 0.5 # (kg), assumed
-    mass = dronemass + parcelmass
+    # ('UAV' in the description means a delivery leg, legs back to the truck or the depot carry nothing)
+    parcel = sorties['Description'].str.contains('UAV', regex=False).to_numpy()
+    UAV_energy_DF = sorties.drop(columns=['euclid_dist'])
+    UAV_energy_DF['Description'] = np.where(parcel, 'parcel', 'nothing')
+
     dronespeed = UAV_info.iloc[-1,3] #(m/s)
-    ro = 1.225 # at sea level (kg/m^3)
-    
     TO_speed = UAV_info.iloc[-1,2] # takeoff speed (m/s)
     LND_speed = UAV_info.iloc[-1,4] # landing speed (m/s)
     CRZ_alt = UAV_info.iloc[-1,6] # cruise alt (m), usually 50m
-    CRZ_speed = dronespeed # cruise speed (m/s)
-
-    sorties['dist_in_m'] = sorties['euclid_dist'] * 1000 # (km) -> (m)
-
-    sorties['total_time'] = sorties['dist_in_m'] / dronespeed # (s)
 
+    dist_in_m = sorties['euclid_dist'].to_numpy() * 1000 # (km) -> (m)
+    total_time = dist_in_m / dronespeed # (s)
     TO_time = CRZ_alt/TO_speed # (s)
-    sorties['TO_time'] = pd.Series([TO_time for _ in range(len(sorties))]) # (s)
     LND_time = CRZ_alt/LND_speed # (s)
-    sorties['LND_time'] = pd.Series([LND_time for _ in range(len(sorties))]) # (s)
-
-    sorties['CRZ_time'] = sorties['total_time'] # (s)
-    
-    energy_cruise = []
-    for i in range(len(sorties['Description'])):
-        if sorties['Description'][i] == 'parcel':
-            energy_cruise.append((beta_1_CRZ * (mass**1.5 / ro**0.5) + beta_0_CRZ) * sorties['CRZ_time'][i])
-        elif sorties['Description'][i] == 'nothing':
-            energy_cruise.append((beta_1_CRZ * (dronemass**1.5 / ro**0.5) + beta_0_CRZ) * sorties['CRZ_time'][i])
-    sorties['energy_cruise'] = pd.Series(energy_cruise)
-
-    energy_takeoff = []
-    for i in range(len(sorties['Description'])):
-        if sorties['Description'][i] == 'parcel':
-            energy_takeoff.append((beta_1_TO * (mass**1.5 / ro**0.5) + beta_0_TO) * sorties['TO_time'][i])
-        elif sorties['Description'][i] == 'nothing':
-            energy_takeoff.append((beta_1_TO * (dronemass**1.5 / ro**0.5) + beta_0_TO) * sorties['TO_time'][i])
-    sorties['energy_takeoff'] = pd.Series(energy_takeoff)
-
-    energy_land = []
-    for i in range(len(sorties['Description'])):
-        if sorties['Description'][i] == 'parcel':
-            energy_land.append((beta_1_LND * (mass**1.5 / ro**0.5) + beta_0_LND) * sorties['LND_time'][i])
-        elif sorties['Description'][i] == 'nothing':
-            energy_land.append((beta_1_LND * (dronemass**1.5 / ro**0.5) + beta_0_LND) * sorties['LND_time'][i])
-    sorties['energy_land'] = pd.Series(energy_land)
-
-    sorties['energy_use(Wh)'] = (
-        sorties['energy_takeoff']
-        + sorties['energy_cruise']
-        + sorties['energy_land']
+    UAV_energy_DF['dist_in_m'] = dist_in_m
+    UAV_energy_DF['total_time'] = total_time
+    UAV_energy_DF['CRZ_time'] = total_time # (s)
+
+    energy_takeoff, energy_cruise, energy_land = DroneEnergyKernel(parcel, total_time, TO_time, LND_time)
+    UAV_energy_DF['energy_use(Wh)'] = (
+        energy_takeoff
+        + energy_cruise
+        + energy_land
         )/3600 # total energy consumption from J to Wh
 
-    sorties.drop(columns = [
-        'energy_takeoff',
-        'energy_cruise',
-        'energy_land',
-        'euclid_dist',
-        'TO_time',
-        'LND_time'], inplace = True)
-    
-    sorties = sorties.round(2)
-
-    UAV_energy_DF = sorties
+    UAV_energy_DF = UAV_energy_DF.round(2)
     return UAV_energy_DF
 
 
+def runDroneEnergyModuleBatch(sorties_list, UAV_info):
+    '''
+    Energy use of the sorties of many instances in a single vectorized pass
+    sorties_list is a list (or dict keyed by instance id) of UAV_DF frames
+    Returns the rows of runDroneEnergyModule for all of them, with an 'instance' column
+    '''
+    if isinstance(sorties_list, dict):
+        keys, frames = list(sorties_list.keys()), list(sorties_list.values())
+    else:
+        keys, frames = list(range(len(sorties_list))), list(sorties_list)
+    sorties = pd.concat(frames, keys=keys, names=['instance', None]).reset_index(level=0).reset_index(drop=True)
+    return runDroneEnergyModule(sorties, UAV_info)
+
+
+def SweepDroneEnergy(sorties, UAV_info, dronemass=(DRONE_MASS,), parcelmass=(PARCEL_MASS,), ro=(AIR_DENSITY,),
+                     coefficients={'Rodrigues et al. (2022)': RODRIGUES_COEFFICIENTS}, cruise_speed=None):
+    '''
+    Total drone energy use (Wh) of stored sorties over every combination of the given parameter values
+    sorties is a UAV_DF (euclid_dist) or a runDroneEnergyModule output (dist_in_m), optionally with an 'instance' column
+    coefficients maps a label to a dict of beta values, cruise_speed defaults to the speed in UAV_info
+    Returns a Series indexed by ([instance,] coefficients, dronemass, parcelmass, ro, cruise_speed)
+    Per-sortie values are not rounded, unlike runDroneEnergyModule
+    '''
+    if cruise_speed is None:
+        cruise_speed = (UAV_info.iloc[-1,3],)
+    TO_time = UAV_info.iloc[-1,6] / UAV_info.iloc[-1,2] # (s)
+    LND_time = UAV_info.iloc[-1,6] / UAV_info.iloc[-1,4] # (s)
+
+    description = sorties['Description'].astype(str)
+    parcel = description.str.contains('UAV', regex=False) | (description == 'parcel')
+    if 'dist_in_m' in sorties.columns:
+        dist_in_m = sorties['dist_in_m']
+    else:
+        dist_in_m = sorties['euclid_dist'] * 1000 # (km) -> (m)
+    instance = sorties['instance'] if 'instance' in sorties.columns else pd.Series(0, index=sorties.index)
+
+    # Energy is linear in the phase times, so sorties only need to be summed per parcel state
+    stats = pd.DataFrame({'instance': instance, 'parcel': parcel, 'dist_in_m': dist_in_m, 'count': 1}).groupby(['instance', 'parcel']).sum()
+    # Every (field, parcel state) column is kept, even when the sorties only have legs of one state or none at all
+    columns = pd.MultiIndex.from_product([['dist_in_m', 'count'], [False, True]], names=[None, 'parcel'])
+    stats = stats.unstack('parcel', fill_value=0).reindex(columns=columns, fill_value=0)
+    if 'instance' not in sorties.columns:
+        # A single instance, which uses no energy when it has no UAV sorties
+        stats = stats.reindex([0], fill_value=0)
+    instances = stats.index.to_numpy()
+
+    # Axes: instance, coefficients, dronemass, parcelmass, ro, cruise_speed
+    shape = (-1, 1, 1, 1, 1, 1)
+    labels = list(coefficients.keys())
+    beta = {name: np.array([coefficients[label][name] for label in labels]).reshape(1, -1, 1, 1, 1, 1) for name in RODRIGUES_COEFFICIENTS}
+    grid = {
+        'dronemass': np.asarray(dronemass, dtype=float).reshape(1, 1, -1, 1, 1, 1),
+        'parcelmass': np.asarray(parcelmass, dtype=float).reshape(1, 1, 1, -1, 1, 1),
+        'ro': np.asarray(ro, dtype=float).reshape(1, 1, 1, 1, -1, 1),
+        }
+    speed = np.asarray(cruise_speed, dtype=float).reshape(1, 1, 1, 1, 1, -1)
+
+    energy = 0
+    for onboard in (False, True):
+        count = stats[('count', onboard)].to_numpy().reshape(shape)
+        dist = stats[('dist_in_m', onboard)].to_numpy(dtype=float).reshape(shape)
+        energy = energy + sum(DroneEnergyKernel(onboard, dist / speed, count * TO_time, count * LND_time, coefficients=beta, **grid))
+    energy = np.broadcast_to(energy / 3600, (len(instances), len(labels), grid['dronemass'].size, grid['parcelmass'].size, grid['ro'].size, speed.size)) # (J) -> (Wh)
+
+    levels = [instances, labels, list(dronemass), list(parcelmass), list(ro), list(cruise_speed)]
+    names = ['instance', 'coefficients', 'dronemass', 'parcelmass', 'ro', 'cruise_speed']
+    cube = pd.Series(energy.ravel(), index=pd.MultiIndex.from_product(levels, names=names), name='energy_use(Wh)')
+    if 'instance' not in sorties.columns:
+        cube = cube.droplevel('instance')
+    return cube
+
+
 def runTruckEnergyModule(truck_tour, matrix_DF_copy, BaselineInformation):
     truck_tour_with_dist = pd.merge(truck_tour, matrix_DF_copy, on=['startNode', 'endNode'])
 
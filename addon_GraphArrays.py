@@ -0,0 +1,192 @@
+import os
+import weakref
+
+import numpy as np
+import osmnx as ox
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Edge attributes added by EnsureEdgeTravelTimes, recorded in G.graph['edge_weights']
+EDGE_WEIGHTS = ('length', 'speed_kph', 'travel_time')
+
+# scipy drops explicit zeros from the adjacency matrix, so zero-weight edges are routed with this weight instead
+MIN_EDGE_WEIGHT = 1e-9
+
+# Sources per Dijkstra call in ShortestPathMatrix; scipy returns (sources x graph nodes) distance and predecessor arrays
+SOURCE_BLOCK = 64
+
+# Array exports are built once per graph object and dropped with it
+_weights_csr = weakref.WeakKeyDictionary()
+_snap_indexes = weakref.WeakKeyDictionary()
+
+def EnsureEdgeTravelTimes(G):
+    '''
+    Adds speed_kph and travel_time to the edges of G once and records it in G.graph['edge_weights']
+    Later calls on the same graph (or on a stored copy of it) return without touching the edges
+    Edges that already carry both weights on every edge are kept as they are
+    '''
+    if set(EDGE_WEIGHTS) <= set(G.graph.get('edge_weights', ())):
+        return G
+    if not all('speed_kph' in data and 'travel_time' in data for _, _, data in G.edges(data=True)):
+        ox.add_edge_speeds(G)
+        ox.add_edge_travel_times(G)
+    G.graph['edge_weights'] = EDGE_WEIGHTS
+    return G
+
+class EdgeWeightsCSR:
+    '''
+    Flat compressed sparse row export of one edge weight of G
+    nodes holds the sorted OSM node ids (index -> id), node_index maps ids back to indices
+    Row i lists the successors of nodes[i] in indices[indptr[i]:indptr[i+1]], with the weight and length of the
+    cheapest parallel edge, i.e. the edge a shortest path on G would use
+    '''
+    FIELDS = ('nodes', 'indptr', 'indices', 'weight', 'length')
+
+    def __init__(self, nodes, indptr, indices, weight, length, weight_name='travel_time'):
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weight = weight
+        self.length = length
+        self.weight_name = weight_name
+        self._matrix = None
+        self._edge_keys = None
+
+    @classmethod
+    def from_graph(cls, G, weight_name='travel_time'):
+        nodes = np.sort(np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes()))
+        m = G.number_of_edges()
+        u = np.empty(m, dtype=np.int64)
+        v = np.empty(m, dtype=np.int64)
+        weight = np.empty(m, dtype=np.float64)
+        length = np.empty(m, dtype=np.float64)
+        for e, (a, b, data) in enumerate(G.edges(data=True)):
+            u[e] = a
+            v[e] = b
+            weight[e] = data[weight_name]
+            length[e] = data['length']
+        u = np.searchsorted(nodes, u)
+        v = np.searchsorted(nodes, v)
+        # Keep the cheapest of each group of parallel edges; the stable sort keeps the first one on ties
+        order = np.lexsort((weight, v, u))
+        u, v, weight, length = u[order], v[order], weight[order], length[order]
+        first = np.ones(m, dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        u, v, weight, length = u[first], v[first], weight[first], length[first]
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u, minlength=len(nodes)), out=indptr[1:])
+        return cls(nodes, indptr, v, weight, length, weight_name)
+
+    def node_index(self, osm_nodes):
+        osm_nodes = np.asarray(osm_nodes, dtype=np.int64)
+        index = np.searchsorted(self.nodes, osm_nodes)
+        missing = self.nodes[np.minimum(index, len(self.nodes) - 1)] != osm_nodes
+        if np.any(missing):
+            raise KeyError('Node(s) not in graph: %s' % np.atleast_1d(osm_nodes)[np.atleast_1d(missing)].tolist())
+        return index
+
+    def matrix(self):
+        # Adjacency matrix for scipy.sparse.csgraph, built on first use
+        if self._matrix is None:
+            n = len(self.nodes)
+            self._matrix = csr_matrix((np.maximum(self.weight, MIN_EDGE_WEIGHT), self.indices, self.indptr), shape=(n, n))
+        return self._matrix
+
+    def edge_position(self, u, v):
+        # Positions of the edges u[i] -> v[i] (node indices) in the flat arrays
+        if self._edge_keys is None:
+            rows = np.repeat(np.arange(len(self.nodes), dtype=np.int64), np.diff(self.indptr))
+            self._edge_keys = rows * len(self.nodes) + self.indices
+        # scipy returns int32 predecessors, and u * n would overflow int32 beyond 46,340 nodes
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        return np.searchsorted(self._edge_keys, u * len(self.nodes) + v)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for field in self.FIELDS:
+            np.save(os.path.join(path, '%s_csr_%s.npy' % (self.weight_name, field)), getattr(self, field))
+
+    @classmethod
+    def load(cls, path, weight_name='travel_time', mmap_mode='r'):
+        '''
+        Returns the export saved in path, memory-mapped by default, or None if there is none
+        '''
+        files = [os.path.join(path, '%s_csr_%s.npy' % (weight_name, field)) for field in cls.FIELDS]
+        if not all(os.path.isfile(file) for file in files):
+            return None
+        return cls(*[np.load(file, mmap_mode=mmap_mode) for file in files], weight_name=weight_name)
+
+def GraphWeightsCSR(G, weight='travel_time'):
+    '''
+    Returns the EdgeWeightsCSR of G for weight, building it on first use
+    '''
+    exports = _weights_csr.setdefault(G, {})
+    if weight not in exports:
+        if weight != 'length':
+            EnsureEdgeTravelTimes(G)
+        exports[weight] = EdgeWeightsCSR.from_graph(G, weight)
+    return exports[weight]
+
+def ShortestPathMatrix(csr, sources, targets):
+    '''
+    Returns (weight_matrix, length_matrix) of the shortest paths (by weight) from sources to targets, both OSM node ids
+    Sources are routed SOURCE_BLOCK at a time in compiled Dijkstra calls; unreachable targets are inf
+    Lengths are summed by walking the predecessors back from each target, so only the source-to-target paths are visited
+    '''
+    src = csr.node_index(sources)
+    dst = csr.node_index(targets)
+    weight = np.empty((len(src), len(dst)))
+    length = np.zeros((len(src), len(dst)))
+    for start in range(0, len(src), SOURCE_BLOCK):
+        block = slice(start, start + SOURCE_BLOCK)
+        dist, pred = dijkstra(csr.matrix(), directed=True, indices=src[block], return_predecessors=True)
+        weight[block] = dist[:, dst]
+
+        # One (source, target) path per entry, walked one edge per step until it reaches its source
+        # (sources and unreached nodes have a negative predecessor)
+        k = dist.shape[0]
+        row = np.repeat(np.arange(k, dtype=np.int64), len(dst))
+        node = np.tile(dst, k)
+        entry = np.arange(k * len(dst))
+        block_length = np.zeros(k * len(dst))
+        while len(entry):
+            parent = pred[row, node].astype(np.int64)
+            active = parent >= 0
+            row, node, parent, entry = row[active], node[active], parent[active], entry[active]
+            block_length[entry] += csr.length[csr.edge_position(parent, node)]
+            node = parent
+        length[block] = block_length.reshape(k, len(dst))
+    return weight, np.where(np.isinf(weight), np.inf, length)
+
+class NodeSnapIndex:
+    '''
+    KD-tree over the node coordinates of a projected graph, built once and queried for every batch of samples
+    nearest(X, Y) accepts scalars or arrays of any shape (e.g. (instances, customers)) and returns OSM node ids of the same shape
+    '''
+    def __init__(self, G):
+        self.nodes = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        xy = np.array([(data['x'], data['y']) for _, data in G.nodes(data=True)], dtype=np.float64).reshape(-1, 2)
+        self.tree = cKDTree(xy)
+
+    def nearest(self, X, Y, return_dist=False):
+        points = np.stack(np.broadcast_arrays(np.asarray(X, dtype=np.float64), np.asarray(Y, dtype=np.float64)), axis=-1)
+        if np.isnan(points).any():
+            raise ValueError('`X` and `Y` cannot contain nulls')
+        dist, position = self.tree.query(points)
+        if return_dist:
+            return self.nodes[position], dist
+        return self.nodes[position]
+
+def GraphNodeIndex(G):
+    '''
+    Returns the NodeSnapIndex of G, building it on first use
+    '''
+    if G not in _snap_indexes:
+        _snap_indexes[G] = NodeSnapIndex(G)
+    return _snap_indexes[G]
+
+def AttachGraphWeightsCSR(G, csr):
+    # Registers an export loaded from disk, so GraphWeightsCSR does not rebuild it
+    _weights_csr.setdefault(G, {})[csr.weight_name] = csr
@@ -0,0 +1,96 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import datetime
+
+import numpy as np
+import networkx as nx
+import osmnx as ox
+
+from addon_OSMnxGeospatialSimulator import BuildBoxGraph
+from addon_GraphArrays import EdgeWeightsCSR, GraphWeightsCSR, AttachGraphWeightsCSR
+from addon_Instrumentation import Span
+
+def GraphStoreKey(city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode='download'):
+    '''
+    Returns the folder name of a stored graph, derived from the parameters of BuildBoxGraph
+    '''
+    params = [city_name, depot_addr, float(bbox_range), float(CityCenterParam)]
+    if SubgraphMode != 'download':
+        params.append(SubgraphMode)
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()[:16]
+
+def SaveGraphStore(store_dir, city_name, depot_addr, bbox_range, CityCenterParam, city, depot_xy, G, Gp, Gp_cust, Gp_cust_mini, SubgraphMode='download'):
+    path = os.path.join(store_dir, GraphStoreKey(city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode))
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    os.makedirs(tmp_path, exist_ok=True)
+
+    meta = {
+        'city_name': city_name,
+        'depot_addr': depot_addr,
+        'bbox_range': bbox_range,
+        'CityCenterParam': CityCenterParam,
+        'SubgraphMode': SubgraphMode,
+        'city': city,
+        'city_center': list(G.graph.get('city_center', ())),
+        'depot_xy': list(depot_xy),
+        'osmnx_version': ox.__version__,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    # Views over Gp cannot be pickled; their node ids are saved as arrays and the views rebuilt on load
+    customer_graphs = []
+    for name, graph in (('Gp_cust', Gp_cust), ('Gp_cust_mini', Gp_cust_mini)):
+        if nx.is_frozen(graph):
+            np.save(os.path.join(tmp_path, '%s_nodes.npy' % name), np.fromiter(graph.nodes, dtype=np.int64))
+            customer_graphs.append(None)
+        else:
+            customer_graphs.append(graph)
+    # Routing weights of the master graph, memory-mapped on load
+    GraphWeightsCSR(G, 'travel_time').save(tmp_path)
+    with open(os.path.join(tmp_path, 'graphs.pkl'), 'wb') as f:
+        pickle.dump((G, Gp, *customer_graphs), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Swap the finished folder in place so an interrupted save never leaves a half-written store
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+def LoadGraphStore(store_dir, city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode='download'):
+    '''
+    Returns (city, depot_xy, G, Gp, Gp_cust, Gp_cust_mini) from the store, or None if it has not been built yet
+    '''
+    path = os.path.join(store_dir, GraphStoreKey(city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode))
+    if not os.path.isfile(os.path.join(path, 'graphs.pkl')):
+        return None
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    with open(os.path.join(path, 'graphs.pkl'), 'rb') as f:
+        G, Gp, Gp_cust, Gp_cust_mini = pickle.load(f)
+    if Gp_cust is None:
+        Gp_cust = Gp.subgraph(np.load(os.path.join(path, 'Gp_cust_nodes.npy'), mmap_mode='r').tolist())
+    if Gp_cust_mini is None:
+        Gp_cust_mini = Gp.subgraph(np.load(os.path.join(path, 'Gp_cust_mini_nodes.npy'), mmap_mode='r').tolist())
+    csr = EdgeWeightsCSR.load(path, 'travel_time')
+    if csr is not None:
+        AttachGraphWeightsCSR(G, csr)
+    return meta['city'], tuple(meta['depot_xy']), G, Gp, Gp_cust, Gp_cust_mini
+
+def BuildBoxGraphStored(city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode='download', store_dir='GraphStore', offline=False):
+    '''
+    Same as BuildBoxGraph, but loads the graphs from store_dir when they were built before
+    With offline=True, a missing store raises FileNotFoundError instead of querying OpenStreetMap
+    '''
+    with Span('build_graph'):
+        stored = LoadGraphStore(store_dir, city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode)
+        if stored is not None:
+            return stored
+        if offline:
+            raise FileNotFoundError('No stored graph for (%s, %s, %s, %s) in %s' % (city_name, depot_addr, bbox_range, CityCenterParam, store_dir))
+        city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraph(city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode)
+        SaveGraphStore(store_dir, city_name, depot_addr, bbox_range, CityCenterParam, city, depot_xy, G, Gp, Gp_cust, Gp_cust_mini, SubgraphMode)
+        return city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini
@@ -1,43 +1,131 @@
+import time
+
 import pandas as pd
 import numpy as np
-import networkx as nx
-from networkx.algorithms.approximation import greedy_tsp
 
 # Columns: 'startNode', 'endNode', 'time(s)', 'dist(m)'
 
-def SolveGreedyTSP(data):
-    # Extract the unique nodes
+def BuildTourMatrices(data):
+    # Pivot the matrix frame straight into dense (n x n) time and distance arrays
     nodes = sorted(data['startNode'].unique())
     num_nodes = len(nodes)
-    
-    # Create a time matrix
+    i = data['startNode'].to_numpy(dtype=int)
+    j = data['endNode'].to_numpy(dtype=int)
+
     time_matrix = np.zeros((num_nodes, num_nodes))
-    for _, row in data.iterrows():
-        i = int(row['startNode'])
-        j = int(row['endNode'])
-        time = row['time(s)']
-        time_matrix[i, j] = time
-    
-    # Create a distance matrix
+    time_matrix[i, j] = data['time(s)'].to_numpy(dtype=float)
+
     distance_matrix = np.zeros((num_nodes, num_nodes))
-    for _, row in data.iterrows():
-        i = int(row['startNode'])
-        j = int(row['endNode'])
-        distance = row['dist(m)']
-        distance_matrix[i, j] = distance
-    
-    # Create a directed graph and add edges
-    graph = nx.DiGraph()
-    for i in range(num_nodes):
-        for j in range(num_nodes):
-            if i != j:
-                graph.add_edge(i, j, weight=time_matrix[i, j])
-    
+    distance_matrix[i, j] = data['dist(m)'].to_numpy(dtype=float)
+    return time_matrix, distance_matrix
+
+def NearestNeighbourTours(cost, starts=(0,)):
+    '''
+    Builds nearest-neighbour tours on a dense cost matrix for every start node at once
+    Ties go to the lowest node index, like networkx greedy_tsp
+    Returns a (len(starts), n+1) array of closed tours
+    '''
+    starts = np.asarray(starts, dtype=int)
+    num_tours = len(starts)
+    num_nodes = cost.shape[0]
+    rows = np.arange(num_tours)
+
+    tours = np.empty((num_tours, num_nodes + 1), dtype=int)
+    tours[:, 0] = starts
+    tours[:, -1] = starts
+    visited = np.zeros((num_tours, num_nodes), dtype=bool)
+    visited[rows, starts] = True
+    current = starts
+    for step in range(1, num_nodes):
+        current = np.argmin(np.where(visited, np.inf, cost[current]), axis=1)
+        tours[:, step] = current
+        visited[rows, current] = True
+    return tours
+
+def TourCost(tours, matrix):
+    # Total cost of one tour or of each row of an array of tours
+    tours = np.asarray(tours)
+    return matrix[tours[..., :-1], tours[..., 1:]].sum(axis=-1)
+
+def _BestTwoOptMove(tour, cost):
+    # Best segment reversal tour[i..j], 1 <= i < j <= n-1, evaluated for all (i, j) at once
+    # Costs may be asymmetric, so the reversed segment is priced with prefix sums of the backward legs
+    num_nodes = len(tour) - 1
+    forward = np.concatenate(([0.0], np.cumsum(cost[tour[:-1], tour[1:]])))
+    backward = np.concatenate(([0.0], np.cumsum(cost[tour[1:], tour[:-1]])))
+    i = np.arange(1, num_nodes)[:, None]
+    j = np.arange(1, num_nodes)[None, :]
+    delta = (cost[tour[i-1], tour[j]] + cost[tour[i], tour[j+1]] + (backward[j] - backward[i])
+             - cost[tour[i-1], tour[i]] - cost[tour[j], tour[j+1]] - (forward[j] - forward[i]))
+    delta = np.where(i < j, delta, np.inf)
+    best = np.unravel_index(np.argmin(delta), delta.shape)
+    return delta[best], (int(i[best[0], 0]), int(j[0, best[1]]))
+
+def _BestOrOptMove(tour, cost, max_segment=3):
+    # Best relocation of a segment tour[i..i+L-1] (L <= max_segment) to the edge tour[k] -> tour[k+1]
+    num_nodes = len(tour) - 1
+    best_delta, best_move = np.inf, None
+    k = np.arange(num_nodes)[None, :]
+    for length in range(1, min(max_segment, num_nodes - 2) + 1):
+        i = np.arange(1, num_nodes - length + 1)[:, None]
+        first, last = tour[i], tour[i+length-1]
+        removal_gain = cost[tour[i-1], first] + cost[last, tour[i+length]] - cost[tour[i-1], tour[i+length]]
+        insertion_cost = cost[tour[k], first] + cost[last, tour[k+1]] - cost[tour[k], tour[k+1]]
+        delta = np.where((k < i-1) | (k > i+length-1), insertion_cost - removal_gain, np.inf)
+        best = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[best] < best_delta:
+            best_delta, best_move = delta[best], (int(i[best[0], 0]), length, int(k[0, best[1]]))
+    return best_delta, best_move
+
+def ImproveTour(tour, cost, time_budget=0.5, max_iter=1000, tol=1e-9):
+    '''
+    Improves a closed tour (depot first and last) with best-improvement 2-opt and Or-opt moves
+    All moves of a kind are priced in one batch of NumPy operations on the cost matrix
+    Stops at a local optimum, after max_iter moves or after time_budget seconds
+    '''
+    tour = np.array(tour, dtype=int)
+    if len(tour) < 5:
+        return tour
+    deadline = time.perf_counter() + time_budget
+    for _ in range(max_iter):
+        two_opt_delta, (i, j) = _BestTwoOptMove(tour, cost)
+        or_opt_delta, or_opt_move = _BestOrOptMove(tour, cost)
+        if min(two_opt_delta, or_opt_delta) >= -tol:
+            break
+        if two_opt_delta <= or_opt_delta:
+            tour[i:j+1] = tour[i:j+1][::-1].copy()
+        else:
+            i, length, k = or_opt_move
+            segment = tour[i:i+length].copy()
+            rest = np.delete(tour, np.arange(i, i+length))
+            position = k + 1 if k < i else k - length + 1
+            tour = np.insert(rest, position, segment)
+        if time.perf_counter() > deadline:
+            break
+    return tour
+
+def SolveGreedyTSP(data, multistart=False, improve=False, time_budget=0.5, max_iter=1000):
+    '''
+    Returns the total distance of a greedy (nearest-neighbour on travel time) truck tour from the depot
+    With multistart, tours are built from every node and the fastest closed tour is kept
+    With improve, the tour is then shortened (in travel time) by 2-opt / Or-opt local search
+    '''
+    time_matrix, distance_matrix = BuildTourMatrices(data)
+
     try:
         # Solve the TSP using a greedy heuristic
-        tour = greedy_tsp(graph, source=0)
-        Total_time = sum(time_matrix[tour[i], tour[i+1]] for i in range(len(tour)-1))
-        Total_dist = sum(distance_matrix[tour[i], tour[i+1]] for i in range(len(tour)-1))
+        if multistart:
+            tours = NearestNeighbourTours(time_matrix, starts=np.arange(time_matrix.shape[0]))
+            tour = tours[np.argmin(TourCost(tours, time_matrix))]
+            # Rotate the closed tour so that it starts and ends at the depot
+            tour = np.roll(tour[:-1], -int(np.flatnonzero(tour[:-1] == 0)[0]))
+            tour = np.append(tour, 0)
+        else:
+            tour = NearestNeighbourTours(time_matrix, starts=[0])[0]
+        if improve:
+            tour = ImproveTour(tour, time_matrix, time_budget=time_budget, max_iter=max_iter)
+        Total_time = TourCost(tour, time_matrix)
+        Total_dist = TourCost(tour, distance_matrix)
 
         # Print the result
         if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 def haversine(latlon1, latlon2):
     # Radius of the Earth in kilometers. Use 3958.8 for miles.
     R = 6371.0
@@ -23,4 +24,27 @@ def haversine(latlon1, latlon2):
     # Distance in kilometers
     distance = R * c
     
-    return distance
\ No newline at end of file
+    return distance
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    # Element-wise haversine distance (km) between arrays of coordinates in degrees; inputs broadcast
+    R = 6371.0
+
+    lat1_rad = np.radians(lat1)
+    lon1_rad = np.radians(lon1)
+    lat2_rad = np.radians(lat2)
+    lon2_rad = np.radians(lon2)
+
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+
+    a = np.sin(dlat / 2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return R * c
+
+def haversine_matrix(lat, lon):
+    # Pairwise (n x n) haversine distance matrix (km) of n coordinates in degrees
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    return haversine_array(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
\ No newline at end of file
@@ -0,0 +1,198 @@
+import os
+import time
+import random
+import warnings
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+from newmain import missionControl
+from addon_OSMnxGeospatialSimulator import SimulateCustomers, GetCustomerSampler, PARCEL_WEIGHTS
+from addon_EnergyConsumptionCalculator import runDroneEnergyModule, runTruckEnergyModule
+from addon_GreedyGroundTSP import SolveGreedyTSP
+from addon_Instrumentation import Instrumented, Span
+
+# Result series recorded for every instance (kWh)
+RESULT_COLUMNS = [
+    'Baseline (Diesel Truck)',
+    'Hybrid (Diesel Truck)',
+    'Baseline (EV Truck)',
+    'Hybrid (EV Truck)',
+    'Baseline (EV Van)',
+    'Hybrid (EV Van)']
+
+# Stage timings, counters and peak memory of each instance are added to its result (see addon_Instrumentation)
+@Instrumented
+def RunSimulationInstance(iterationno, city, depot_xy, G, Gp, Gp_cust, Gp_cust_mini, BaselineInformation,
+                          cache=None, problemName='myproblem', SaveCSV=False, seed=None, verbose=False, ExportProblemCSV=False,
+                          ImproveBaseline=False, RoutingBackend='networkx', NumCustomers=10, ParcelWeights=PARCEL_WEIGHTS,
+                          DepotPlacement='address'):
+    '''
+    Runs one Monte Carlo instance: customer sampling, mFSTSP heuristic, energy modules and baseline TSP
+    The problem is handed to the solver in memory; ExportProblemCSV also writes it to Problems/<problemName>
+    ImproveBaseline refines the greedy baseline tour with 2-opt / Or-opt local search
+    RoutingBackend, NumCustomers, ParcelWeights and DepotPlacement are passed on to SimulateCustomers
+    Returns a dict with the energy estimates of RESULT_COLUMNS, the seed, the elapsed time and the instrumentation record
+    '''
+    int_start_time = time.time()
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+
+    #____________________________________________________________
+    # MODULE I: GEOSPATIAL SIMULATOR
+
+    # Sampled customers are occasionally disconnected from the depot, so retry with a new batch
+    for attempt in range(3):
+        try:
+            matrix_DF_copy, problem = SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini,cache=cache,problemName=problemName,
+                                                        ExportCSV=ExportProblemCSV,ReturnProblem=True,RoutingBackend=RoutingBackend,
+                                                        seed=None if seed is None else [seed, attempt],
+                                                        NumCustomers=NumCustomers,ParcelWeights=ParcelWeights,DepotPlacement=DepotPlacement)
+            break
+        except Exception:
+            if attempt == 2:
+                raise
+
+    #____________________________________________________________
+    # MODULE II: MFSTSP HEURISTIC SOLVER
+
+    # Solve once and take every frame from the same heuristic run
+    with Span('solve_mfstsp'):
+        solution = missionControl(problemName, problem=problem).return_solution()
+    a = solution['nodes_DF']
+    b = solution['sol_DF']
+    sorties = solution['UAV_DF'].copy()
+    truck_tour = solution['Truck_DF'].copy()
+    UAV_info = solution['UAV_INFO_DF']
+    if verbose:
+        print('Routing & Scheduling Plan Retrieved')
+
+    if SaveCSV == True:
+        os.makedirs('Simulation_Instances_CSV', exist_ok=True)
+        a.to_csv(f'Simulation_Instances_CSV/Customer_Nodes{iterationno}.csv')
+        b.to_csv(f'Simulation_Instances_CSV/mFSTSP_Solution{iterationno}.csv')
+
+    #____________________________________________________________
+    # MODULE III: ENERGY USE CALCULATOR
+
+    with Span('energy_modules'):
+        UAV_energy_DF = runDroneEnergyModule(sorties, UAV_info)
+        Ground_energy_DF = runTruckEnergyModule(truck_tour, matrix_DF_copy, BaselineInformation)
+    UAV_energy_sum = round(UAV_energy_DF['energy_use(Wh)'].sum(), 4)
+    Truck_energy_sum = round(Ground_energy_DF['energy(Wh, Diesel Truck)'].sum(), 4)
+    EVTruck_energy_sum = round(Ground_energy_DF['energy(Wh, EV Truck)'].sum(), 4)
+    EVVan_energy_sum = round(Ground_energy_DF['energy(Wh, EV Van)'].sum(), 4)
+    if verbose:
+        print('Energy Use for Hybrid Scenario Calculated')
+
+    #____________________________________________________________
+    # Solve baseline TSP
+
+    with Span('baseline_tsp'):
+        baseline_tsp_dist = SolveGreedyTSP(matrix_DF_copy, improve=ImproveBaseline)
+    baseline_tsp_DF = pd.DataFrame(
+    [[BaselineInformation['Diesel Truck'] * baseline_tsp_dist / 1000,
+    BaselineInformation['EV Truck'] * baseline_tsp_dist / 1000,
+    BaselineInformation['EV Van'] * baseline_tsp_dist / 1000]],
+    columns=['energy(Wh, Diesel Truck)',
+             'energy(Wh, EV Truck)',
+             'energy(Wh, EV Van)']
+    )
+    if verbose:
+        print('Energy Use for Baseline Scenario Calculated')
+
+    #____________________________________________________________
+    # Complete this simulation instance and record its result
+
+    result = {
+        'instance': iterationno,
+        'seed': seed,
+        'Baseline (Diesel Truck)': round(baseline_tsp_DF['energy(Wh, Diesel Truck)'][0]/1000, 4),
+        'Hybrid (Diesel Truck)': round((UAV_energy_sum + Truck_energy_sum)/1000, 4),
+        'Baseline (EV Truck)': round(baseline_tsp_DF['energy(Wh, EV Truck)'][0]/1000, 4),
+        'Hybrid (EV Truck)': round((UAV_energy_sum + EVTruck_energy_sum)/1000, 4),
+        'Baseline (EV Van)': round(baseline_tsp_DF['energy(Wh, EV Van)'][0]/1000, 4),
+        'Hybrid (EV Van)': round((UAV_energy_sum + EVVan_energy_sum)/1000, 4),
+        'UAV_energy_DF': UAV_energy_DF,
+    }
+    result['elapsed'] = round(time.time() - int_start_time, 2)
+    return result
+
+# Set in the parent right before the pool forks, so every worker inherits the graphs without pickling them
+_WorkerState = {}
+
+def _RunWorkerInstance(task):
+    iterationno, seed = task
+    state = _WorkerState
+    cache = state['cache']
+    if cache is not None:
+        # This copy of the cache is never saved, so new routes go back to the parent with the result
+        cache.track()
+    try:
+        result = RunSimulationInstance(iterationno, *state['graphs'], state['BaselineInformation'],
+                                       cache=cache, problemName='myproblem_%d' % os.getpid(),
+                                       seed=seed, **state['options'])
+    except Exception as e:
+        result = {'instance': iterationno, 'seed': seed, 'error': repr(e)}
+    if cache is not None:
+        result['route_cache_entries'] = cache.drain()
+    return result
+
+def RunMonteCarloParallel(MonteCarloInstances, city, depot_xy, G, Gp, Gp_cust, Gp_cust_mini, BaselineInformation,
+                          workers=None, cache=None, seed=None, callback=None, skip=(), stop=None, **options):
+    '''
+    Runs MonteCarloInstances instances of RunSimulationInstance on a pool of forked worker processes
+    Each worker writes its problem files to its own Problems/myproblem_<pid> folder
+    options (e.g. SaveCSV, ImproveBaseline) are passed on to RunSimulationInstance
+    callback(result) is called in this process as each instance finishes
+    Instance numbers in skip (e.g. completed in an earlier run) are not run
+    Routes the workers add to cache are merged into it here, and it is saved every cache.save_every instances and at the end
+    stop() (e.g. StoppingRule.should_stop) is called after each callback, and the remaining instances are cancelled once it returns True
+    Returns the results of the successful instances, ordered by instance number
+    '''
+    if 'fork' not in mp.get_all_start_methods():
+        raise RuntimeError('Parallel runs need the "fork" start method, which is not available on this platform.')
+    if workers is None:
+        workers = mp.cpu_count()
+    # Instances must draw different customers even though forked workers share the parent's random state
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**31)
+
+    # Build the customer sampler and load the route cache once here, so the forked workers inherit them
+    GetCustomerSampler(Gp, Gp_cust, Gp_cust_mini)
+    if cache is not None:
+        cache.bind(G, 'travel_time')
+
+    global _WorkerState
+    _WorkerState = {
+        'graphs': (city, depot_xy, G, Gp, Gp_cust, Gp_cust_mini),
+        'BaselineInformation': BaselineInformation,
+        'cache': cache,
+        'options': options,
+    }
+    tasks = [(iterationno, seed + iterationno) for iterationno in range(MonteCarloInstances) if iterationno not in skip]
+    results = []
+    try:
+        with mp.get_context('fork').Pool(processes=workers) as pool:
+            # With a stopping rule, results are taken in instance order, so where a study converges does not depend on worker timing
+            imap = pool.imap_unordered if stop is None else pool.imap
+            for result in imap(_RunWorkerInstance, tasks):
+                if cache is not None:
+                    cache.merge(result.pop('route_cache_entries'))
+                    cache.checkpoint()
+                if 'error' in result:
+                    warnings.warn('[ EXCEPTION ] Instance #%d failed and is skipped: %s' % (result['instance']+1, result['error']))
+                    continue
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+                if stop is not None and stop():
+                    break
+    finally:
+        _WorkerState = {}
+        if cache is not None:
+            cache.save()
+    results.sort(key=lambda result: result['instance'])
+    return results
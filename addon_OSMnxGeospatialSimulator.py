@@ -1,11 +1,58 @@
 import os
-import random
+import heapq
+import itertools
+import weakref
 
 import numpy as np
 import pandas as pd
+import networkx as nx
 import osmnx as ox
+import shapely
+import pyproj
 
-def BuildBoxGraph(city_name, depot_addr, bbox_range, CityCenterParam):
+from addon_ProblemData import ProblemData
+from addon_Instrumentation import Span, Count
+from addon_GraphArrays import EnsureEdgeTravelTimes, GraphWeightsCSR, ShortestPathMatrix, GraphNodeIndex
+
+# Shortest-path implementations accepted by BuildTravelMatrix and SimulateCustomers
+ROUTING_BACKENDS = ('networkx', 'csr')
+
+# Default parcel mix: (weight in lbs, share of customers), 80% of parcels are light enough for the UAVs
+PARCEL_WEIGHTS = ((1.1, 0.8), (100, 0.2))
+
+# Where the depot of each instance is placed:
+# 'address': the geocoded depot address, 'center': the city center, 'random': sampled like a customer
+DEPOT_PLACEMENTS = ('address', 'center', 'random')
+
+# One CustomerSampler per customer region graph, built on first use
+_samplers = weakref.WeakKeyDictionary()
+
+def _BoxSubgraph(G, Gp, center, dist, SubgraphMode):
+    '''
+    Returns the part of Gp within the same bounding box as ox.graph.graph_from_point(center, dist, dist_type='bbox')
+    Nodes are selected on the unprojected G, so the box matches a separate download of that area
+    SubgraphMode 'view' returns a read-only view over Gp, 'truncate' returns a copy
+    '''
+    earth_radius = 6371009 # (m), as used by osmnx
+    delta_lat = (dist / earth_radius) * (180 / np.pi)
+    delta_lon = delta_lat / np.cos(np.radians(center[0]))
+    nodes = [node for node, data in G.nodes(data=True)
+             if abs(data['y'] - center[0]) <= delta_lat and abs(data['x'] - center[1]) <= delta_lon]
+    # Keep the largest weakly connected component, like graph_from_point does by default
+    sub = Gp.subgraph(nodes)
+    sub = Gp.subgraph(max(nx.weakly_connected_components(sub), key=len))
+    if SubgraphMode == 'truncate':
+        sub = sub.copy()
+    return sub
+
+def BuildBoxGraph(city_name, depot_addr, bbox_range, CityCenterParam, SubgraphMode='download'):
+    '''
+    SubgraphMode sets how the customer regions Gp_cust and Gp_cust_mini are built:
+    'download' queries OpenStreetMap for each region, 'truncate' copies them out of Gp,
+    'view' keeps them as lightweight views over Gp
+    '''
+    if SubgraphMode not in ('download', 'truncate', 'view'):
+        raise ValueError("SubgraphMode must be 'download', 'truncate' or 'view', not %r" % SubgraphMode)
     pd.options.display.float_format = '{:.6f}'.format
     os.makedirs('Problems/myproblem', exist_ok=True)
     if __name__ == '__main__':
@@ -19,61 +66,251 @@ def BuildBoxGraph(city_name, depot_addr, bbox_range, CityCenterParam):
         print('Building graph representation for : %s' % city)
 
     G = ox.graph.graph_from_point(city_center, dist=bbox_range*1000+2000, dist_type='bbox', network_type='drive', truncate_by_edge=False)
+    G.graph['city_center'] = city_center
+    # Impute speed and travel time for edges in the graph, once for every instance simulated on it
+    EnsureEdgeTravelTimes(G)
     Gp = ox.project_graph(G)
 
-    G_cust = ox.graph.graph_from_point(city_center, dist=bbox_range*1000, dist_type='bbox', network_type='drive', truncate_by_edge=False)
-    Gp_cust = ox.project_graph(G_cust)
+    if SubgraphMode == 'download':
+        G_cust = ox.graph.graph_from_point(city_center, dist=bbox_range*1000, dist_type='bbox', network_type='drive', truncate_by_edge=False)
+        Gp_cust = ox.project_graph(G_cust)
 
-    G_cust_mini = ox.graph.graph_from_point(city_center, dist=bbox_range*1000*CityCenterParam, dist_type='bbox', network_type='drive', truncate_by_edge=False)
-    Gp_cust_mini = ox.project_graph(G_cust_mini)
+        G_cust_mini = ox.graph.graph_from_point(city_center, dist=bbox_range*1000*CityCenterParam, dist_type='bbox', network_type='drive', truncate_by_edge=False)
+        Gp_cust_mini = ox.project_graph(G_cust_mini)
+    else:
+        # Customer regions are bounding-box subsets of the master graph
+        Gp_cust = _BoxSubgraph(G, Gp, city_center, bbox_range*1000, SubgraphMode)
+        Gp_cust_mini = _BoxSubgraph(G, Gp, city_center, bbox_range*1000*CityCenterParam, SubgraphMode)
 
     if __name__ == '__main__':
         print('Done!')
 
     return city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini
 
-def SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini):
-    # Create 10 sample customer locations within the graph border
-    if random.random() <=0.5:
-        points = ox.utils_geo.sample_points(ox.convert.to_undirected(Gp_cust), n=10)
-    elif random.random() >0.5:
-        points = ox.utils_geo.sample_points(ox.convert.to_undirected(Gp_cust_mini), n=10)
-    X = points.x.values
-    Y = points.y.values
-    
-    
-    # Identify closest nodes for each sample locations
-    cust_nodes = ox.nearest_nodes(Gp, X, Y, return_dist=False)
+class CustomerSampler:
+    '''
+    Samples customer locations uniformly along the streets of Gp_cust or Gp_cust_mini, like ox.utils_geo.sample_points
+    The undirected edge geometries and their length CDF are computed once, so each draw only interpolates points
+    '''
+    def __init__(self, Gp, Gp_cust, Gp_cust_mini):
+        geometry = []
+        cdf = []
+        for region in (Gp_cust, Gp_cust_mini):
+            gdf_edges = ox.convert.graph_to_gdfs(ox.convert.to_undirected(region), nodes=False)[['geometry', 'length']]
+            length = gdf_edges['length'].to_numpy(dtype=np.float64)
+            geometry.append(gdf_edges['geometry'].to_numpy())
+            cdf.append(np.cumsum(length) / length.sum())
+        # Both regions share one geometry array; edges of region r start at self.offset[r]
+        self.geometry = np.concatenate(geometry)
+        self.cdf = cdf
+        self.offset = np.array([0, len(geometry[0])])
+        self.to_wgs84 = pyproj.Transformer.from_crs(Gp.graph['crs'], 'EPSG:4326', always_xy=True)
+        self.from_wgs84 = pyproj.Transformer.from_crs('EPSG:4326', Gp.graph['crs'], always_xy=True)
+        self.snap_index = GraphNodeIndex(Gp)
+        self._graphs = (weakref.ref(Gp), weakref.ref(Gp_cust_mini))
+
+    def draw(self, K, n, seed=None):
+        '''
+        Draws n customers for each of K instances, with one independent random stream per instance spawned from seed
+        The region (Gp_cust or Gp_cust_mini) is picked with equal probability for each instance
+        Returns (lon, lat, nodes, region): (K, n) arrays of WGS84 coordinates and nearest nodes of Gp, and the (K,) region index
+        '''
+        streams = [np.random.default_rng(stream) for stream in np.random.SeedSequence(seed).spawn(K)]
+        region = np.empty(K, dtype=np.int64)
+        edge = np.empty((K, n), dtype=np.int64)
+        fraction = np.empty((K, n))
+        for k, rng in enumerate(streams):
+            region[k] = 0 if rng.random() < 0.5 else 1
+            cdf = self.cdf[region[k]]
+            edge[k] = self.offset[region[k]] + np.minimum(np.searchsorted(cdf, rng.random(n), side='right'), len(cdf) - 1)
+            fraction[k] = rng.random(n)
+
+        # Interpolate, reproject and snap all K x n points at once
+        points = shapely.line_interpolate_point(self.geometry[edge], fraction, normalized=True)
+        X = shapely.get_x(points)
+        Y = shapely.get_y(points)
+        with Span('snap_nodes'):
+            nodes = self.snap_index.nearest(X, Y)
+        lon, lat = self.to_wgs84.transform(X, Y)
+        return np.asarray(lon), np.asarray(lat), nodes, region
+
+    def snap(self, lat, lon):
+        # Nearest node of Gp to WGS84 coordinates
+        X, Y = self.from_wgs84.transform(lon, lat)
+        return self.snap_index.nearest(X, Y)
+
+def GetCustomerSampler(Gp, Gp_cust, Gp_cust_mini):
+    '''
+    Returns the CustomerSampler of (Gp, Gp_cust, Gp_cust_mini), building it on first use
+    '''
+    sampler = _samplers.get(Gp_cust)
+    if sampler is None or sampler._graphs[0]() is not Gp or sampler._graphs[1]() is not Gp_cust_mini:
+        sampler = CustomerSampler(Gp, Gp_cust, Gp_cust_mini)
+        _samplers[Gp_cust] = sampler
+    return sampler
+
+def ParcelWeightList(NumCustomers, ParcelWeights=PARCEL_WEIGHTS):
+    '''
+    Returns the parcel weights (lbs) of NumCustomers customers, split by the shares in ParcelWeights
+    Shares are rounded cumulatively, so the counts always add up to NumCustomers
+    '''
+    weights = np.array([weight for weight, _ in ParcelWeights], dtype=np.float64)
+    shares = np.array([share for _, share in ParcelWeights], dtype=np.float64)
+    if len(weights) == 0 or np.any(shares < 0) or shares.sum() <= 0:
+        raise ValueError('ParcelWeights must be (weight, share) pairs with non-negative shares, not %r' % (ParcelWeights,))
+    bounds = np.round(np.cumsum(shares) / shares.sum() * NumCustomers).astype(np.int64)
+    counts = np.diff(bounds, prepend=0)
+    return np.repeat(weights, counts)
+
+def _time_and_length_tree(G, orig, targets, weight="travel_time"):
+    '''
+    Grows one single-source shortest-path tree from orig (minimizing weight)
+    and returns {node: (route_time, route_length)} for every node in targets.
+    Stops as soon as all targets are settled.
+    Parallel edges are resolved like ox.routing.route_to_gdf, i.e. the edge with the smallest weight is used.
+    '''
+    remaining = set(targets)
+    remaining.discard(orig)
+    found = {orig: (0.0, 0.0)}
+    seen = {orig: 0.0}
+    length = {orig: 0.0}
+    settled = set()
+    counter = itertools.count()
+    heap = [(0.0, next(counter), orig)]
+    while heap and remaining:
+        d, _, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+        if u in remaining:
+            remaining.discard(u)
+            found[u] = (d, length[u])
+        for v, keydict in G.succ[u].items():
+            if v in settled:
+                continue
+            edge = min(keydict.values(), key=lambda x: x[weight])
+            vd = d + edge[weight]
+            if v not in seen or vd < seen[v]:
+                seen[v] = vd
+                length[v] = length[u] + edge["length"]
+                heapq.heappush(heap, (vd, next(counter), v))
+    if remaining:
+        raise nx.NetworkXNoPath('No route from node %s to node(s) %s' % (orig, sorted(remaining)))
+    return found
+
+def _csr_trees(G, missing, weight="travel_time"):
+    '''
+    Same result as _time_and_length_tree for every origin in missing ({orig: targets}),
+    routed on the CSR export of G with a single compiled Dijkstra call
+    '''
+    origins = list(missing)
+    targets = sorted(set().union(*missing.values()))
+    route_time, route_length = ShortestPathMatrix(GraphWeightsCSR(G, weight), origins, targets)
+    trees = {}
+    for a, orig in enumerate(origins):
+        trees[orig] = {}
+        for b, dest in enumerate(targets):
+            if dest in missing[orig]:
+                if np.isinf(route_time[a, b]):
+                    raise nx.NetworkXNoPath('No route from node %s to node %s' % (orig, dest))
+                trees[orig][dest] = (float(route_time[a, b]), float(route_length[a, b]))
+    return trees
+
+def BuildTravelMatrix(G, osm_nodes, weight="travel_time", cache=None, backend='networkx'):
+    '''
+    Returns (time_matrix, dist_matrix) between osm_nodes as integer arrays in s and m
+    Runs one shortest-path tree per distinct origin node instead of one query per (i, j) pair
+    backend 'networkx' grows the trees on G, 'csr' routes all origins at once on the CSR export of G (see addon_GraphArrays)
+    If a RouteCache is given, only pairs missing from the cache are routed
+    Returns 0 for distance and time if nodes are self-referential
+    '''
+    if backend not in ROUTING_BACKENDS:
+        raise ValueError("backend must be one of %s, not %r" % (ROUTING_BACKENDS, backend))
+    osm_nodes = [int(node) for node in osm_nodes]
+    targets = set(osm_nodes)
+    n = len(osm_nodes)
+    time_matrix = np.zeros((n, n), dtype=np.int64)
+    dist_matrix = np.zeros((n, n), dtype=np.int64)
+    if cache is not None:
+        cache.bind(G, weight)
+
+    # Look up cached pairs first, then route what is left for each distinct origin
+    trees = {}
+    missing = {}
+    for orig in dict.fromkeys(osm_nodes):
+        trees[orig] = {}
+        if cache is not None:
+            for dest in targets - {orig}:
+                cached = cache.get(orig, dest)
+                if cached is not None:
+                    trees[orig][dest] = cached
+        remaining = targets - {orig} - trees[orig].keys()
+        if remaining:
+            missing[orig] = remaining
+    Count('shortest_path_trees', len(missing))
+    if backend == 'csr' and missing:
+        routed = _csr_trees(G, missing, weight=weight)
+    else:
+        routed = {orig: _time_and_length_tree(G, orig, missing[orig], weight=weight) for orig in missing}
+    for orig in missing:
+        for dest in missing[orig]:
+            trees[orig][dest] = routed[orig][dest]
+            if cache is not None:
+                cache.put(orig, dest, *routed[orig][dest])
+
+    for i in range(n):
+        orig = osm_nodes[i]
+        for j in range(n):
+            if osm_nodes[j] != orig:
+                route_time, route_length = trees[orig][osm_nodes[j]]
+                time_matrix[i, j] = int(route_time)
+                dist_matrix[i, j] = int(route_length)
+    return time_matrix, dist_matrix
+
+def SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini,cache=None,problemName='myproblem',ExportCSV=True,ReturnProblem=False,RoutingBackend='networkx',seed=None,
+                      NumCustomers=10,ParcelWeights=PARCEL_WEIGHTS,DepotPlacement='address'):
+    '''
+    Samples a customer batch and returns its truck travel matrix as matrix_DF_copy
+    ExportCSV writes the problem to Problems/<problemName>, ReturnProblem also returns it as a ProblemData
+    RoutingBackend selects the shortest-path implementation of BuildTravelMatrix ('networkx' or 'csr')
+    seed (an int or a sequence of ints) makes the customer sample reproducible
+    NumCustomers customers get parcels split by ParcelWeights (see ParcelWeightList), DepotPlacement is one of DEPOT_PLACEMENTS
+    '''
+    if NumCustomers < 1:
+        raise ValueError('NumCustomers must be at least 1, not %r' % NumCustomers)
+    if DepotPlacement not in DEPOT_PLACEMENTS:
+        raise ValueError('DepotPlacement must be one of %s, not %r' % (DEPOT_PLACEMENTS, DepotPlacement))
+
+    # Create NumCustomers sample customer locations within Gp_cust or Gp_cust_mini (see CustomerSampler)
+    # A randomly placed depot is drawn as one more point of the same sample
+    num_points = NumCustomers + 1 if DepotPlacement == 'random' else NumCustomers
+    with Span('sample_customers'):
+        sampler = GetCustomerSampler(Gp, Gp_cust, Gp_cust_mini)
+        X_wgs84, Y_wgs84, cust_nodes, _ = sampler.draw(1, num_points, seed)
+    X_wgs84 = X_wgs84[0]
+    Y_wgs84 = Y_wgs84[0]
+    cust_nodes = cust_nodes[0]
+    if DepotPlacement == 'random':
+        depot_lat, depot_lon, depot_node = Y_wgs84[-1], X_wgs84[-1], cust_nodes[-1]
+        X_wgs84, Y_wgs84, cust_nodes = X_wgs84[:-1], Y_wgs84[:-1], cust_nodes[:-1]
+    else:
+        depot_lat, depot_lon = depot_xy if DepotPlacement == 'address' else G.graph['city_center']
+        with Span('snap_nodes'):
+            depot_node = sampler.snap(depot_lat, depot_lon)
     if __name__ == '__main__':
         print('Nearest nodes for customers :', cust_nodes)
-    depot_node = ox.nearest_nodes(Gp, depot_xy[1], depot_xy[0])
-    if __name__ == '__main__':
         print('Nearest node for delivery depot :', depot_node)
 
-    # Convert projection from X/Y to WGS84
-    points_wgs84 = ox.projection.project_gdf(points, to_crs='WGS84', to_latlong=False)
-    X_wgs84 = points_wgs84.x.values
-    Y_wgs84 = points_wgs84.y.values
-    
-    # Append depot location as the last entry of the nodes
-    X_wgs84 = np.append(X_wgs84, depot_xy[1])
-    Y_wgs84 = np.append(Y_wgs84, depot_xy[0])
-    X_wgs84 = np.round(X_wgs84, decimals=6)
-    Y_wgs84 = np.round(Y_wgs84, decimals=6)
-
-    # Create DataFrame for all nodes
-    nodes_DF = pd.DataFrame([cust_nodes, X_wgs84, Y_wgs84], index=['node_no', 'x_coord', 'y_coord'])
-    nodes_DF = nodes_DF.T
-    nodes_DF.iloc[10,0] = depot_node
-    nodes_DF['% nodeID'] = list(range(1,10+1)) + [0]
-    nodes_DF['nodeType'] = [1 for _ in range(10)] + [0]
-    nodes_DF['latDeg'] = nodes_DF['y_coord']
-    nodes_DF['lonDeg'] = nodes_DF['x_coord']
-    nodes_DF['altMeters'] = [0 for _ in range(10)] + [0]
-    nodes_DF['parcelWtLbs'] = [1.1 for _ in range(8)] + [100 for _ in range(2)]+[-1]
-    nodes_DF.drop(columns=['x_coord', 'y_coord'], inplace=True)
-    nodes_DF = nodes_DF.reindex([10,0,1,2,3,4,5,6,7,8,9])
-    nodes_DF = nodes_DF.reset_index(drop = True)
+    # Create DataFrame for all nodes, depot first
+    nodes_DF = pd.DataFrame({
+        'node_no': np.append(depot_node, cust_nodes),
+        '% nodeID': np.arange(NumCustomers + 1),
+        'nodeType': np.append(0, np.ones(NumCustomers, dtype=np.int64)),
+        'latDeg': np.round(np.append(depot_lat, Y_wgs84), decimals=6),
+        'lonDeg': np.round(np.append(depot_lon, X_wgs84), decimals=6),
+        'altMeters': np.zeros(NumCustomers + 1, dtype=np.int64),
+        'parcelWtLbs': np.append(-1.0, ParcelWeightList(NumCustomers, ParcelWeights)),
+    })
 
     if __name__ == '__main__':
         print(nodes_DF.to_string())
@@ -83,66 +320,41 @@ def SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini):
 
     nodes_DF_out = nodes_DF.copy()
     nodes_DF_out.drop(columns=['node_no'], inplace=True)
-    nodes_DF_out.to_csv('Problems/myproblem/tbl_locations.csv', index=False)
-    if __name__ == '__main__':
-        print("Nodes information saved at :'Problems/myproblem/tbl_locations.csv'.\n")
-    
-    # Impute speed and travel time for edges in the graph
-    G = ox.add_edge_speeds(G)
-    G = ox.add_edge_travel_times(G)
-    def dist_and_time(orig, dest):
-        '''
-        Returns origin node, destination node, distance in km, time in s
-        Returns 0 for distance and time if nodes are self-referential
-        '''
-        if int(orig) == int(dest):
-            route_length = 0
-            route_time = 0
-        else:
-            route = ox.shortest_path(G, orig, dest, weight="travel_time")
-            # ox.plot_graph_route(G, route, route_color="y", route_linewidth=6, node_size=0)
-            route_length = int(sum(ox.routing.route_to_gdf(G, route, weight="travel_time")["length"]))
-            route_time = int(sum(ox.routing.route_to_gdf(G, route, weight="travel_time")["travel_time"]))
-        return (str(orig), str(dest), route_length, route_time)
-
-    # Build DataFrame for distance & time matrix
+
+    # Impute speed and travel time for edges in the graph (skipped if already done for G)
+    EnsureEdgeTravelTimes(G)
+
+    # Build distance & time matrix
     if __name__ == '__main__':
         print('Building distance & time matrix for nodes in : %s' % city, '\nEstimated time : 15s...')
-    mFSTSP_travel_columns = [
-        '% from location i',
-        ' to location j',
-        ' time [sec]',
-        ' distance [meters]']
-    
-    matrix = []
-    for i in range(len(nodes_DF)):
-        for j in range(len(nodes_DF)):
-            line = [
-            i,
-            j,
-            dist_and_time(nodes_DF['node_no'][i], nodes_DF['node_no'][j])[3],
-            dist_and_time(nodes_DF['node_no'][i], nodes_DF['node_no'][j])[2]
-            ]
-            matrix.append(line)
+    with Span('travel_matrix'):
+        time_matrix, dist_matrix = BuildTravelMatrix(G, nodes_DF['node_no'].values, weight="travel_time", cache=cache, backend=RoutingBackend)
     if __name__ == '__main__':
         print('Done!\n')
-    matrix_DF = pd.DataFrame(matrix, columns = mFSTSP_travel_columns)
+
+    # Hand the problem to missionControl in memory, the CSV files are an optional export
+    problem = ProblemData(nodes_DF_out, time_matrix, dist_matrix)
+    if ExportCSV:
+        problem.to_csv(problemName)
+        if __name__ == '__main__':
+            print("Nodes information saved at :'Problems/%s/tbl_locations.csv'." % problemName)
+            print("Distance & Time matrix saved at :'Problems/%s/tbl_truck_travel_data_PG.csv'.\n" % problemName)
+
+    matrix_DF = problem.truck_travel_DF()
     pd.options.display.float_format = None
     if __name__ == '__main__':
         print(matrix_DF.to_string())
-    matrix_DF.to_csv('Problems/myproblem/tbl_truck_travel_data_PG.csv', index=False)
-    if __name__ == '__main__':
-        print("Distance & Time matrix saved at :'Problems/myproblem/tbl_truck_travel_data_PG.csv'.\n")
     matrix_DF_copy = matrix_DF.copy()
     matrix_DF_copy['startNode'] = matrix_DF_copy['% from location i']
     matrix_DF_copy['endNode'] = matrix_DF_copy[' to location j']
     matrix_DF_copy['time(s)'] = matrix_DF_copy[' time [sec]']
     matrix_DF_copy['dist(m)'] = matrix_DF_copy[' distance [meters]']
     matrix_DF_copy.drop(columns=['% from location i', ' to location j', ' time [sec]', ' distance [meters]'], inplace=True)
-    return matrix_DF_copy
     if __name__ == '__main__':
         print("Distance & Time matrix returned as a global variable 'matrix_DF_copy'.")
-
+    if ReturnProblem:
+        return matrix_DF_copy, problem
+    return matrix_DF_copy
 
 if __name__ == '__main__':
     city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraph("Pittsburgh, PA", '1723 Murray Ave, Pittsburgh, PA', 15, 0.5)
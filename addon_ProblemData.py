@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+LOCATION_COLUMNS = ['% nodeID', 'nodeType', 'latDeg', 'lonDeg', 'altMeters', 'parcelWtLbs']
+TRUCK_TRAVEL_COLUMNS = ['% from location i', ' to location j', ' time [sec]', ' distance [meters]']
+
+# tbl_vehicles files are parsed once per process
+_vehicle_tables = {}
+
+def ReadVehicleTable(vehiclesFile):
+    '''
+    Returns the rows of a tbl_vehicles file as a NumPy record array
+    '''
+    if vehiclesFile not in _vehicle_tables:
+        df = pd.read_csv(vehiclesFile, skiprows=[0], keep_default_na=False)
+        _vehicle_tables[vehiclesFile] = df.to_records(index=False)
+    return _vehicle_tables[vehiclesFile]
+
+class ProblemData:
+    '''
+    In-memory mFSTSP problem that missionControl accepts in place of the Problems/<problemName> CSV files
+    Nodes follow the columns of tbl_locations.csv (depot first), truck_time and truck_dist are (n x n) arrays in s and m
+    '''
+    def __init__(self, nodes_DF, truck_time, truck_dist, vehiclesFile='Problems/tbl_vehicles_999.csv'):
+        self.nodeID = nodes_DF['% nodeID'].to_numpy()
+        self.nodeType = nodes_DF['nodeType'].to_numpy()
+        self.latDeg = nodes_DF['latDeg'].to_numpy()
+        self.lonDeg = nodes_DF['lonDeg'].to_numpy()
+        self.altMeters = nodes_DF['altMeters'].to_numpy()
+        self.parcelWtLbs = nodes_DF['parcelWtLbs'].to_numpy()
+        self.truck_time = np.asarray(truck_time)
+        self.truck_dist = np.asarray(truck_dist)
+        self.vehiclesFile = vehiclesFile
+
+    @property
+    def vehicles(self):
+        return ReadVehicleTable(self.vehiclesFile)
+
+    def nodes_DF(self):
+        # Same frame as reading tbl_locations.csv back with pandas
+        return pd.DataFrame(dict(zip(LOCATION_COLUMNS, [self.nodeID, self.nodeType, self.latDeg, self.lonDeg, self.altMeters, self.parcelWtLbs])))
+
+    def truck_travel_DF(self):
+        n = len(self.nodeID)
+        return pd.DataFrame(dict(zip(TRUCK_TRAVEL_COLUMNS, [
+            np.repeat(np.arange(n), n),
+            np.tile(np.arange(n), n),
+            self.truck_time.ravel(),
+            self.truck_dist.ravel()])))
+
+    # Rows in the layout missionControl.readData gets from parseCSV / parseCSVstring
+    def location_rows(self):
+        return list(zip(self.nodeID.tolist(), self.nodeType.tolist(), self.latDeg.tolist(), self.lonDeg.tolist(), self.altMeters.tolist(), self.parcelWtLbs.tolist()))
+
+    def vehicle_rows(self):
+        return self.vehicles.tolist()
+
+    def to_csv(self, problemName='myproblem'):
+        # Optional export of the problem in the mFSTSP file layout
+        os.makedirs('Problems/%s' % problemName, exist_ok=True)
+        self.nodes_DF().to_csv('Problems/%s/tbl_locations.csv' % problemName, index=False)
+        self.truck_travel_DF().to_csv('Problems/%s/tbl_truck_travel_data_PG.csv' % problemName, index=False)
@@ -0,0 +1,74 @@
+import os
+import csv
+
+import pandas as pd
+
+from addon_MonteCarloRunner import RESULT_COLUMNS
+from addon_Instrumentation import INSTRUMENTATION_COLUMNS
+
+# Columns logged for every finished instance: energy estimates (kWh), then stage timings (s), counters and peak memory (MB)
+SINK_COLUMNS = ['instance', 'seed', 'elapsed'] + RESULT_COLUMNS + INSTRUMENTATION_COLUMNS
+
+class ResultSink:
+    '''
+    Append-only CSV log of finished simulation instances
+    Every row is flushed and synced to disk as soon as it is written, so a crash loses at most the instances still running
+    With resume=True an existing log is kept and completed() returns the instance ids already in it,
+    otherwise the log is started afresh
+    '''
+    def __init__(self, path, columns=SINK_COLUMNS, resume=False):
+        self.path = path
+        self.columns = list(columns)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if resume and os.path.isfile(path):
+            self._DropPartialRow()
+        if resume and os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, newline='') as f:
+                header = next(csv.reader(f), None)
+            if header != self.columns:
+                raise ValueError('%s was written with different columns and cannot be resumed' % path)
+            self._file = open(path, 'a', newline='')
+            self._writer = csv.writer(self._file)
+        else:
+            self._file = open(path, 'w', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.columns)
+            self._Sync()
+
+    def _DropPartialRow(self):
+        # A crash in the middle of a write leaves an unterminated last line; cut it off before appending
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _Sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def completed(self):
+        '''
+        Returns the set of instance ids already in the log
+        '''
+        with open(self.path, newline='') as f:
+            return {int(row['instance']) for row in csv.DictReader(f) if row['instance']}
+
+    def write(self, result):
+        self._writer.writerow(['' if result.get(column) is None else result[column] for column in self.columns])
+        self._Sync()
+
+    def read(self):
+        # Every instance logged so far, ordered by instance id
+        self._file.flush()
+        return pd.read_csv(self.path).sort_values(by=['instance']).reset_index(drop=True)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
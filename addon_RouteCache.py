@@ -0,0 +1,137 @@
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from addon_Instrumentation import Count
+
+# Part of every cache file name; bump it whenever cached routes could have been computed wrongly,
+# so files written by an older version are no longer read
+# 2: CSR route lengths were wrong on graphs with more than 46,340 nodes before version 2
+CACHE_FORMAT_VERSION = 2
+
+def GraphFingerprint(G, weight="travel_time"):
+    '''
+    Returns a short hex digest identifying the road network and the weight used for routing
+    Two graphs with the same edges, lengths and weights share the same fingerprint, for the same CACHE_FORMAT_VERSION
+    '''
+    edges = np.array(
+        [(u, v, k, data.get(weight, np.nan), data.get("length", np.nan)) for u, v, k, data in G.edges(keys=True, data=True)],
+        dtype=np.float64).reshape(-1, 5)
+    edges = edges[np.lexsort((edges[:, 2], edges[:, 1], edges[:, 0]))]
+    digest = hashlib.sha1(('%d:%s' % (CACHE_FORMAT_VERSION, weight)).encode())
+    digest.update(np.ascontiguousarray(edges).tobytes())
+    return digest.hexdigest()[:16]
+
+class RouteCache:
+    '''
+    Persistent cache of (orig_osm_node, dest_osm_node) -> (time_s, length_m)
+    One binary file per graph fingerprint is kept in cache_dir, entries are evicted least recently used first
+    checkpoint() saves the file once every save_every calls (e.g. once per instance), save() saves it right away
+    '''
+    def __init__(self, cache_dir='Cache', max_entries=1000000, save_every=10):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self.fingerprint = None
+        self.weight = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._graph = None
+        self._dirty = False
+        self._pending = 0
+        # Entries put since the last drain(), once track() was called
+        self._new = None
+
+    def bind(self, G, weight="travel_time"):
+        # Attach the cache to a graph, loading the matching file from disk
+        if self._graph is G and self.weight == weight:
+            return
+        fingerprint = GraphFingerprint(G, weight)
+        if fingerprint != self.fingerprint:
+            self.save()
+            self.fingerprint = fingerprint
+            self.entries = OrderedDict()
+            self.load()
+        self._graph = G
+        self.weight = weight
+
+    @property
+    def path(self):
+        return os.path.join(self.cache_dir, 'route_cache_%s.npz' % self.fingerprint)
+
+    def get(self, orig, dest):
+        key = (orig, dest)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            Count('route_cache_hits')
+            return self.entries[key]
+        self.misses += 1
+        Count('route_cache_misses')
+        return None
+
+    def put(self, orig, dest, route_time, route_length):
+        key = (orig, dest)
+        self.entries[key] = (route_time, route_length)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._dirty = True
+        if self._new is not None:
+            self._new.append((orig, dest, route_time, route_length))
+
+    def track(self):
+        # Start collecting new entries, e.g. in a worker process whose copy of the cache is never saved
+        if self._new is None:
+            self._new = []
+
+    def drain(self):
+        '''
+        Returns the (orig, dest, time_s, length_m) entries put since track() or the previous drain()
+        '''
+        new = self._new or []
+        if self._new is not None:
+            self._new = []
+        return new
+
+    def merge(self, entries):
+        # Add entries drained from another copy of this cache
+        for orig, dest, route_time, route_length in entries:
+            self.put(orig, dest, route_time, route_length)
+
+    def checkpoint(self):
+        self._pending += 1
+        if self._pending >= self.save_every:
+            self.save()
+
+    def load(self):
+        if self.fingerprint is None or not os.path.isfile(self.path):
+            return
+        with np.load(self.path) as data:
+            # Stored oldest first, so re-inserting keeps the LRU order
+            for orig, dest, route_time, route_length in zip(data['orig'].tolist(), data['dest'].tolist(), data['time'].tolist(), data['length'].tolist()):
+                self.entries[(orig, dest)] = (route_time, route_length)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._dirty = False
+
+    def save(self):
+        self._pending = 0
+        if self.fingerprint is None or not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        n = len(self.entries)
+        keys = np.fromiter((k for key in self.entries for k in key), dtype=np.int64, count=2*n).reshape(n, 2)
+        values = np.fromiter((x for value in self.entries.values() for x in value), dtype=np.float64, count=2*n).reshape(n, 2)
+        # Write to a temporary file first so a concurrent reader never sees a partial cache
+        tmp_path = self.path[:-len('.npz')] + '.%d.tmp.npz' % os.getpid()
+        np.savez(tmp_path, orig=keys[:, 0], dest=keys[:, 1], time=values[:, 0], length=values[:, 1])
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,221 @@
+# https://github.com/sgbaik-decaf/TruckDroneEnergySimulator
+
+#_________________________[DISCLAIMER]_______________________
+
+# Non-interactive counterpart of addon_main.py, for schedulers, containers and scripted sweeps.
+# Parameters come from a JSON config file and/or command line arguments (the command line wins),
+# nothing is plotted and nothing is asked.
+
+# python addon_batch_main.py --city "Pittsburgh, PA" --depot "4800 Forbes Ave, Pittsburgh, PA" --instances 100 --seed 1 --workers 8
+# python addon_batch_main.py --config study.json
+# python addon_batch_main.py --config study.json --resume      (after a crash: runs only the instances missing from the output file)
+# python addon_batch_main.py --config study.json --adaptive --instances 200      (stops early once the energy savings have converged)
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import warnings
+import multiprocessing as mp
+
+import numpy as np
+
+from addon_RouteCache import RouteCache
+from addon_GraphStore import BuildBoxGraphStored
+from addon_MonteCarloRunner import RunSimulationInstance, RunMonteCarloParallel, RESULT_COLUMNS
+from addon_ResultSink import ResultSink
+from addon_Instrumentation import Recording, TrackStageMemory
+from addon_AdaptiveStopping import StoppingRule
+
+# Every setting of a batch run; a config file may set any of these keys
+DEFAULT_CONFIG = {
+    'city': None,
+    'depot': None,
+    'bbox_range': 10,
+    'city_center_param': 0.5,
+    'instances': 1,
+    'seed': None,
+    'workers': 1,
+    'output': 'Results/output_DataFrame.csv',
+    'resume': False,
+    'save_instance_csv': False,
+    'num_customers': 10,
+    'parcel_weights': [[1.1, 0.8], [100, 0.2]],
+    'depot_placement': 'address',
+    'subgraph_mode': 'view',
+    'routing_backend': 'csr',
+    'improve_baseline': False,
+    'graph_store': 'GraphStore',
+    'offline': False,
+    'cache_dir': 'Cache',
+    # Peak memory of each stage; resets the process peak memory at every stage (see addon_Instrumentation.Recorder)
+    'stage_memory': True,
+    # Energy intensity of the baseline vehicles (Wh/km), as in addon_main.py
+    'baseline': {'Diesel Truck': 2665.69, 'EV Truck': 621.37, 'EV Van': 347.97},
+    # Adaptive stopping: 'instances' becomes the maximum, and the run stops once the confidence interval of the
+    # energy savings of every vehicle class is narrower than ci_width times its mean (or after time_budget seconds)
+    'adaptive': False,
+    'ci_width': 0.1,
+    'confidence': 0.95,
+    'min_instances': 5,
+    'time_budget': None,
+}
+
+def ParseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Run truck-drone energy simulation instances without prompts.')
+    parser.add_argument('--config', help='JSON file with any of the settings below (command line arguments take precedence)')
+    parser.add_argument('--city', help='city name, e.g. "Pittsburgh, PA"')
+    parser.add_argument('--depot', help='address of the delivery depot')
+    parser.add_argument('--bbox', dest='bbox_range', type=float, help='size of the area of operations (km)')
+    parser.add_argument('--cc', dest='city_center_param', type=float, help='city center parameter')
+    parser.add_argument('--instances', type=int, help='number of simulation instances')
+    parser.add_argument('--seed', type=int, help='base seed; instance i uses seed + i (drawn at random and printed if not given)')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    parser.add_argument('--output', help='CSV file the per-instance results are appended to as they finish')
+    parser.add_argument('--resume', action='store_const', const=True,
+                        help='keep the results already in the output file and run only the missing instances')
+    parser.add_argument('--save-instance-csv', dest='save_instance_csv', action='store_const', const=True,
+                        help='also save the nodes and solution of each instance in Simulation_Instances_CSV')
+    parser.add_argument('--customers', dest='num_customers', type=int, help='customers per instance')
+    parser.add_argument('--depot-placement', dest='depot_placement', choices=['address', 'center', 'random'])
+    parser.add_argument('--routing-backend', dest='routing_backend', choices=['csr', 'networkx'])
+    parser.add_argument('--improve-baseline', dest='improve_baseline', action='store_const', const=True,
+                        help='refine the baseline tour with 2-opt / Or-opt')
+    parser.add_argument('--graph-store', dest='graph_store', help='folder of stored graphs')
+    parser.add_argument('--offline', action='store_const', const=True, help='fail instead of querying OpenStreetMap')
+    parser.add_argument('--no-stage-memory', dest='stage_memory', action='store_const', const=False,
+                        help='do not record the peak memory of each stage (leaves the process peak memory untouched)')
+    parser.add_argument('--adaptive', action='store_const', const=True,
+                        help='stop before --instances once the confidence intervals of the energy savings are narrow enough')
+    parser.add_argument('--ci-width', dest='ci_width', type=float, help='target confidence interval width, relative to the mean saving')
+    parser.add_argument('--min-instances', dest='min_instances', type=int, help='instances to run before the intervals are checked')
+    parser.add_argument('--time-budget', dest='time_budget', type=float, help='stop starting new instances after this many seconds')
+    return parser, parser.parse_args(argv)
+
+def LoadConfig(args):
+    '''
+    Returns the settings of a run: DEFAULT_CONFIG, updated by the config file, updated by the command line
+    '''
+    config = dict(DEFAULT_CONFIG)
+    if args.config is not None:
+        with open(args.config) as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError('Unknown setting(s) in %s: %s' % (args.config, ', '.join(sorted(unknown))))
+        config.update(file_config)
+    config.update({key: value for key, value in vars(args).items() if key in DEFAULT_CONFIG and value is not None})
+    if not config['city'] or not config['depot']:
+        raise ValueError('Both a city and a depot address are required (--city / --depot or the config file).')
+    return config
+
+def RunBatch(config):
+    '''
+    Builds (or loads) the graph once, runs config['instances'] simulation instances and appends each result to config['output']
+    With config['resume'], instances already in the output file are not run again
+    With config['adaptive'], the run stops early once the savings have converged (see StoppingRule), and the intervals
+    are saved next to the output file as <output>_intervals.csv
+    Returns a DataFrame of every instance in the output file, ordered by instance number
+    '''
+    start_time = time.time()
+    TrackStageMemory(config['stage_memory'])
+    with Recording() as recorder:
+        city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraphStored(config['city'], config['depot'], config['bbox_range'], config['city_center_param'],
+                                                                      config['subgraph_mode'], store_dir=config['graph_store'], offline=config['offline'])
+    record = recorder.record()
+    print(f'Graph Representation for "{city}" Generated in {record["time_build_graph"]:.2f} seconds (peak memory {record["peak_rss_mb"]} MB)', flush=True)
+
+    route_cache = RouteCache(cache_dir=config['cache_dir'])
+    options = {
+        'SaveCSV': config['save_instance_csv'],
+        'ImproveBaseline': config['improve_baseline'],
+        'RoutingBackend': config['routing_backend'],
+        'NumCustomers': config['num_customers'],
+        'ParcelWeights': tuple(tuple(pair) for pair in config['parcel_weights']),
+        'DepotPlacement': config['depot_placement'],
+    }
+
+    sink = ResultSink(config['output'], resume=config['resume'])
+    completed = sink.completed()
+    if completed:
+        print('Resuming: %d of %d instances are already in "%s".' % (len(completed & set(range(config['instances']))), config['instances'], config['output']), flush=True)
+
+    seed = config['seed']
+    if seed is None:
+        # Every instance still gets a logged seed: keep the base seed of the run being resumed, or draw a new one
+        logged = sink.read().dropna(subset=['seed'])
+        if len(logged) > 0:
+            seed = int(logged['seed'].iloc[0]) - int(logged['instance'].iloc[0])
+        else:
+            seed = random.SystemRandom().randrange(2**31)
+        print('Base seed: %d (pass --seed %d to repeat this run)' % (seed, seed), flush=True)
+
+    rule = None
+    if config['adaptive']:
+        rule = StoppingRule(config['ci_width'], config['confidence'], config['min_instances'], config['instances'], config['time_budget'])
+        # Instances kept from an earlier run count towards the intervals
+        for _, row in sink.read().iterrows():
+            rule.update(row)
+
+    def RecordResult(result):
+        sink.write(result)
+        if rule is not None:
+            rule.update(result)
+        print(f"Instance #{result['instance']+1}/{config['instances']} took {result['elapsed']} seconds", flush=True)
+
+    if rule is not None and rule.should_stop():
+        print('The instances already in "%s" meet the stopping rule.' % config['output'], flush=True)
+    elif config['workers'] > 1 and 'fork' in mp.get_all_start_methods():
+        RunMonteCarloParallel(config['instances'], city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini, config['baseline'],
+                              workers=config['workers'], cache=route_cache, seed=seed, callback=RecordResult, skip=completed,
+                              stop=None if rule is None else rule.should_stop, **options)
+    else:
+        if config['workers'] > 1:
+            warnings.warn('Parallel runs are not supported on this platform. Instances will run one after another.')
+        for iterationno in range(config['instances']):
+            if iterationno in completed:
+                continue
+            if rule is not None and rule.should_stop():
+                break
+            try:
+                result = RunSimulationInstance(iterationno, city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini, config['baseline'],
+                                               cache=route_cache, seed=seed + iterationno, **options)
+            except Exception as e:
+                warnings.warn('[ EXCEPTION ] Instance #%d failed and is skipped: %r' % (iterationno+1, e))
+                continue
+            route_cache.checkpoint()
+            RecordResult(result)
+        route_cache.save()
+
+    output_DF = sink.read()
+    sink.close()
+    if len(output_DF) > 0:
+        print('%d of %d instances completed (%.2f seconds), results saved as "%s".' % (len(output_DF), config['instances'], time.time()-start_time, config['output']))
+        for column in RESULT_COLUMNS:
+            print('{:<30s}{:>12.4f} kWh'.format(column, np.average(output_DF[column])))
+    if rule is not None and rule.n > 0:
+        rule.should_stop()
+        intervals = rule.intervals()
+        intervals.to_csv(os.path.splitext(config['output'])[0] + '_intervals.csv')
+        print('Stopped after %d instances (%s). Savings of the hybrid scenario (kWh), %d%% confidence intervals:'
+              % (rule.n, rule.reason or 'all instances run', config['confidence'] * 100))
+        print(intervals.to_string())
+    return output_DF
+
+def main(argv=None):
+    parser, args = ParseArguments(argv)
+    try:
+        config = LoadConfig(args)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    output_DF = RunBatch(config)
+    if len(output_DF) == 0:
+        print('[ EXCEPTION ] No simulation instance was completed.', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
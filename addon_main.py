@@ -13,11 +13,22 @@
 # 2. Pandas        https://pandas.pydata.org/docs/getting_started/install.html
 # 3. NetworkX      https://networkx.org/documentation/stable/install.html
 # 4. OSMnx         https://osmnx.readthedocs.io/en/stable/installation.html
-# 5. mFSTSP solver package (THE WHOLE THING including GUROBIPY)
+# 5. SciPy         https://scipy.org/install/
+# 6. mFSTSP solver package (THE WHOLE THING including GUROBIPY)
 # "addon_OSMnxGeospatialSimulator.py",
 # "addon_EnergyConsumptionCalculator.py",
 # "addon_HaversineFunction.py",
 # "addon_GreedyGroundTSP.py"
+# "addon_ProblemData.py"
+# "addon_GraphArrays.py"
+# "addon_RouteCache.py"
+# "addon_GraphStore.py"
+# "addon_MonteCarloRunner.py"
+# "addon_ResultSink.py"
+# "addon_Instrumentation.py"
+# "addon_AdaptiveStopping.py"
+# "addon_batch_main.py" (non-interactive runs)
+# "addon_Benchmark.py" (offline benchmark)
 # "newmain.py"
 
 #____________________________________________________________
@@ -32,6 +43,7 @@ try:
     from collections import defaultdict
     import os
     import os.path
+    import shutil
     import random
     import multiprocessing as mp
     from subprocess import call
@@ -40,6 +52,7 @@ try:
     import numpy as np
     import pandas as pd
     import networkx as nx
+    import scipy
     from networkx.algorithms.approximation import greedy_tsp
     import osmnx as ox
     
@@ -54,6 +67,11 @@ try:
     from addon_EnergyConsumptionCalculator import *
     from addon_HaversineFunction import haversine
     from addon_GreedyGroundTSP import SolveGreedyTSP
+    from addon_RouteCache import RouteCache
+    from addon_GraphStore import BuildBoxGraphStored
+    from addon_MonteCarloRunner import RunSimulationInstance, RunMonteCarloParallel
+    from addon_ResultSink import ResultSink
+    from addon_AdaptiveStopping import StoppingRule
 
 except:
     print('One or more modules or packages(dependencies) have not been found in your environment.')
@@ -76,7 +94,7 @@ print('{:<20s}{:<10s}{:<20s}{:<10s}'.format(
 #____________________________________________________________
 # Get User Inputs
 
-print('_' * os.get_terminal_size().columns)
+print('_' * shutil.get_terminal_size().columns)
 
 print('SET PARAMETERS')
 
@@ -102,6 +120,8 @@ if MonteCarloIndicator == 1:
     SaveEnergyUseResults = int(input('>>'))-1
     print('\nSave nodes and solutions of each simulation instance as .csv files? \n[1]: No\n[2]: Yes')
     SaveCSV = bool(int(input('>>'))-1)
+    print(f'\nSet number of worker processes to run simulations in parallel. \n(Suggested: 1-{mp.cpu_count()}, 1 runs one instance at a time)')
+    Workers = int(input('>>'))
 
 elif MonteCarloIndicator == 0:
     MonteCarloInstances = 1
@@ -110,6 +130,7 @@ elif MonteCarloIndicator == 0:
     print('\nDisplay intermediate data? \n[1]: No\n[2]: Yes')
     DisplayIntermediateDataFrame = bool(int(input('>>'))-1)
     SaveCSV = False
+    Workers = 1
 
 # ENERGY INTENSITY VALUES (US DOE 2020, depot to door delivery scenario)
 # Class 6 Diesel Truck: 4.29 kWh/mi = 2665.69 Wh/km
@@ -118,6 +139,43 @@ elif MonteCarloIndicator == 0:
 
 BaselineInformation = {'Diesel Truck':2665.69, 'EV Truck':621.37, 'EV Van':347.97}
 
+# CUSTOMER SAMPLING REGIONS
+# 'view': cut out of the downloaded graph (one OpenStreetMap query)
+# 'download': queried from OpenStreetMap separately (three queries)
+SubgraphMode = 'view'
+
+# BASELINE TOUR
+# True: refine the greedy baseline tour with 2-opt / Or-opt local search
+ImproveBaselineTour = False
+
+# CUSTOMERS
+# NumCustomers: delivery stops per instance
+# ParcelWeights: (parcel weight in lbs, share of customers)
+# DepotPlacement: 'address' (depot address above), 'center' (city center) or 'random' (sampled like a customer)
+NumCustomers = 10
+ParcelWeights = ((1.1, 0.8), (100, 0.2))
+DepotPlacement = 'address'
+
+# TRUCK ROUTING
+# 'csr': compiled Dijkstra on an array copy of the road network (fast)
+# 'networkx': NetworkX graph traversal
+RoutingBackend = 'csr'
+
+# SEED
+# Instance i samples its customers with seed Seed + i, which is logged with its result
+# None: a base seed is drawn at random and printed; set it to that number to repeat a study
+Seed = None
+
+# ADAPTIVE STOPPING (Monte Carlo Simulation only)
+# True: the number of simulations becomes a maximum, and the simulation stops once the confidence interval of the
+#       energy savings of every vehicle class is narrower than CIWidth times its mean (after at least MinInstances),
+#       or once TimeBudget seconds have passed (None: no time limit)
+AdaptiveStopping = False
+CIWidth = 0.1
+Confidence = 0.95
+MinInstances = 5
+TimeBudget = None
+
 
 
 #____________________________________________________________
@@ -125,160 +183,100 @@ BaselineInformation = {'Diesel Truck':2665.69, 'EV Truck':621.37, 'EV Van':347.9
 
 start_time = time.time()
 
-print('_' * os.get_terminal_size().columns)
-
-BaselineEnergyConsumption_DieselTruck = []
-BaselineEnergyConsumption_ElecTruck = []
-BaselineEnergyConsumption_ElecVan = []
-HybridEnergyConsumption_DieselTruck = []
-HybridEnergyConsumption_ElecTruck = []
-HybridEnergyConsumption_ElecVan = []
-
-GeneratedNodes = []
+print('_' * shutil.get_terminal_size().columns)
 
-for iterationno in range(MonteCarloInstances):
-    int_start_time = time.time()
-    print(f'Running Simulation Instance #{iterationno+1}/{MonteCarloInstances}...')
+# Road distances between OSM nodes persist on disk across instances and runs
+route_cache = RouteCache()
 
 
 
-    #____________________________________________________________
-    # MODULE I: GEOSPATIAL SIMULATOR
+#____________________________________________________________
+# MODULE I: GEOSPATIAL SIMULATOR (graph representation)
 
-    if iterationno == 0:
-        print('Iteration #1 typically takes longer.')
-        try:
-            city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraph(city_input, depot_input, bbox_range, CityCenterParam)
-            print(f'Graph Representation for "{city}" Generated')
-            ox.plot.plot_graph(G, node_size=0.5)
-            matrix_DF_copy = SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini)
-            print('Customer Batch & Travel Matrix Generated')
-        except:
-            try:
-                print('[ WARNING ] OpenStreetMap and/or OSMnx is not working as expected.\nThe program will try executing one last time.')
-                city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraph(city_input, depot_input, bbox_range, CityCenterParam)
-                print(f'Graph Representation for "{city}" Generated')
-                ox.plot.plot_graph(G, node_size=0.5)
-                matrix_DF_copy = SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini)
-                print('Customer Batch & Travel Matrix Generated')
-            except:
-                sys.exit('[ EXCEPTION ] There was an error with OpenStreetMap and/or OSMnx. Common causes are: \n(1) OSM query input issue \n(2) Internet connection issue \n(3) Disconnected node')
-    elif iterationno >= 1:
-        try:
-            matrix_DF_copy = SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini)
-        except:
-            try:
-                matrix_DF_copy = SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini)
-            except:
-                try:
-                    print('[ WARNING ] OpenStreetMap and/or OSMnx is not working as expected.\nThe program will try executing one last time.')
-                    matrix_DF_copy = SimulateCustomers(city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini)
-                except:
-                    warnings.warn('[ EXCEPTION ] There was an error with OpenStreetMap and/or OSMnx. The program reiterate previous instance.')
-
-
-    #____________________________________________________________
-    # MODULE II: MFSTSP HEURISTIC SOLVER
-
-    (a, b, c, d) = (
-        missionControl().return_nodes_DF(),
-        missionControl().return_sol_DF(),
-        missionControl().return_UAV_DF(),
-        missionControl().return_Truck_DF()
-                 )
-    sorties = c.copy()
-    truck_tour = d.copy()
-    UAV_info = missionControl().return_UAV_INFO_DF()
-    if MonteCarloIndicator == 0:
-        print('Routing & Scheduling Plan Retrieved')
-        
-    if SaveCSV == True:
-        a.to_csv(f'Simulation_Instances_CSV/Customer_Nodes{iterationno}.csv')
-        b.to_csv(f'Simulation_Instances_CSV/mFSTSP_Solution{iterationno}.csv')
-
-
-
-    #____________________________________________________________
-    # MODULE III: ENERGY USE CALCULATOR
-
-    UAV_energy_DF = runDroneEnergyModule(sorties, UAV_info)
-    Ground_energy_DF = runTruckEnergyModule(truck_tour, matrix_DF_copy, BaselineInformation)
-    UAV_energy_sum = round(UAV_energy_DF['energy_use(Wh)'].sum(), 4)
-    Truck_energy_sum = round(Ground_energy_DF['energy(Wh, Diesel Truck)'].sum(), 4)
-    EVTruck_energy_sum = round(Ground_energy_DF['energy(Wh, EV Truck)'].sum(), 4)
-    EVVan_energy_sum = round(Ground_energy_DF['energy(Wh, EV Van)'].sum(), 4)
-    
-    if MonteCarloIndicator == 0:
-        print('Energy Use for Hybrid Scenario Calculated')
+print('Building graph representation. This typically takes longer than a simulation instance.')
+try:
+    city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraphStored(city_input, depot_input, bbox_range, CityCenterParam, SubgraphMode)
+    print(f'Graph Representation for "{city}" Generated')
+    ox.plot.plot_graph(G, node_size=0.5)
+except:
+    try:
+        print('[ WARNING ] OpenStreetMap and/or OSMnx is not working as expected.\nThe program will try executing one last time.')
+        city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini = BuildBoxGraphStored(city_input, depot_input, bbox_range, CityCenterParam, SubgraphMode)
+        print(f'Graph Representation for "{city}" Generated')
+        ox.plot.plot_graph(G, node_size=0.5)
+    except:
+        sys.exit('[ EXCEPTION ] There was an error with OpenStreetMap and/or OSMnx. Common causes are: \n(1) OSM query input issue \n(2) Internet connection issue \n(3) Disconnected node')
 
 
 
-    #____________________________________________________________
-    # Solve baseline TSP
+#____________________________________________________________
+# MODULE I-III: SIMULATION INSTANCES
 
-    baseline_tsp_dist = SolveGreedyTSP(matrix_DF_copy)
-    baseline_tsp_DF = pd.DataFrame(
-    [[BaselineInformation['Diesel Truck'] * baseline_tsp_dist / 1000,
-    BaselineInformation['EV Truck'] * baseline_tsp_dist / 1000,
-    BaselineInformation['EV Van'] * baseline_tsp_dist / 1000]],
-    columns=['energy(Wh, Diesel Truck)',
-             'energy(Wh, EV Truck)',
-             'energy(Wh, EV Van)']
-    )
+if Seed is None:
+    Seed = random.SystemRandom().randrange(2**31)
+print(f'Base seed: {Seed}')
 
-    if MonteCarloIndicator == 0:
-        print('Energy Use for Baseline Scenario Calculated')
+# Each finished instance is logged to disk right away, so a crash does not lose the instances completed before it
+if SaveEnergyUseResults == 1:
+    result_sink = ResultSink('Results/output_log.csv')
+
+stopping_rule = None
+if AdaptiveStopping and MonteCarloIndicator == 1:
+    stopping_rule = StoppingRule(CIWidth, Confidence, MinInstances, MonteCarloInstances, TimeBudget)
+
+def PrintInstanceResult(result):
+    if SaveEnergyUseResults == 1:
+        result_sink.write(result)
+    if stopping_rule is not None:
+        stopping_rule.update(result)
+    print(f"Baseline(Diesel Truck): {result['Baseline (Diesel Truck)']} kWh")
+    print(f"Truck-Drone Hybrid(Diesel Truck): {result['Hybrid (Diesel Truck)']} kWh")
+    print('Simulation Result Noted')
+    print(f"Instance #{result['instance']+1} took {result['elapsed']} seconds "
+          f"(sampling {result['time_sample_customers']:.2f}s, routing {result['time_travel_matrix']:.2f}s, mFSTSP {result['time_solve_mfstsp']:.2f}s, "
+          f"energy {result['time_energy_modules']:.2f}s, baseline {result['time_baseline_tsp']:.2f}s)\n")
+
+if Workers > 1 and 'fork' in mp.get_all_start_methods():
+    print(f'Running {MonteCarloInstances} Simulation Instances on {Workers} worker processes...')
+    results = RunMonteCarloParallel(MonteCarloInstances, city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini, BaselineInformation,
+                                    workers=Workers, cache=route_cache, seed=Seed, callback=PrintInstanceResult,
+                                    stop=None if stopping_rule is None else stopping_rule.should_stop,
+                                    SaveCSV=SaveCSV, ImproveBaseline=ImproveBaselineTour, RoutingBackend=RoutingBackend,
+                                    NumCustomers=NumCustomers, ParcelWeights=ParcelWeights, DepotPlacement=DepotPlacement)
+else:
+    if Workers > 1:
+        print('[ WARNING ] Parallel runs are not supported on this platform. Instances will run one after another.')
+    results = []
+    for iterationno in range(MonteCarloInstances):
+        if stopping_rule is not None and stopping_rule.should_stop():
+            break
+        print(f'Running Simulation Instance #{iterationno+1}/{MonteCarloInstances}...')
+        try:
+            result = RunSimulationInstance(iterationno, city,depot_xy,G,Gp,Gp_cust,Gp_cust_mini, BaselineInformation,
+                                           cache=route_cache, seed=Seed + iterationno, SaveCSV=SaveCSV, verbose=(MonteCarloIndicator == 0),
+                                           ImproveBaseline=ImproveBaselineTour, RoutingBackend=RoutingBackend,
+                                           NumCustomers=NumCustomers, ParcelWeights=ParcelWeights, DepotPlacement=DepotPlacement)
+        except:
+            warnings.warn('[ EXCEPTION ] There was an error with OpenStreetMap and/or OSMnx. This instance is skipped.')
+            continue
+        route_cache.checkpoint()
+        results.append(result)
+        PrintInstanceResult(result)
+    route_cache.save()
 
+if SaveEnergyUseResults == 1:
+    result_sink.close()
 
+if len(results) == 0:
+    sys.exit('[ EXCEPTION ] No simulation instance was completed.')
 
-    #____________________________________________________________
-    # Complete this simulation instance and record its result
-    
-    BaselineEnergyConsumption_DieselTruck.append(
-        round(
-            baseline_tsp_DF['energy(Wh, Diesel Truck)'][0]
-            /1000,
-            4)
-        )
-    HybridEnergyConsumption_DieselTruck.append(
-        round(
-            (UAV_energy_sum + Truck_energy_sum)
-            /1000,
-            4)
-        )
-    
-    BaselineEnergyConsumption_ElecTruck.append(
-        round(
-            baseline_tsp_DF['energy(Wh, EV Truck)'][0]
-            /1000,
-            4)
-        )
-    HybridEnergyConsumption_ElecTruck.append(
-        round(
-            (UAV_energy_sum + EVTruck_energy_sum)
-            /1000,
-            4)
-        )
-    
-    BaselineEnergyConsumption_ElecVan.append(
-        round(
-            baseline_tsp_DF['energy(Wh, EV Van)'][0]
-            /1000,
-            4)
-        )
-    HybridEnergyConsumption_ElecVan.append(
-        round(
-            (UAV_energy_sum + EVVan_energy_sum)
-            /1000,
-            4)
-        )
-    
-    int_end_time = time.time()
-    int_time = round(int_end_time - int_start_time, 2)
-    print(f"Baseline(Diesel Truck): {round(baseline_tsp_DF['energy(Wh, Diesel Truck)'][0]/1000,4)} kWh")
-    print(f"Truck-Drone Hybrid(Diesel Truck): {round((UAV_energy_sum + Truck_energy_sum)/1000,4)} kWh")
-    print('Simulation Result Noted')
-    print(f'Instance #{iterationno+1} took {int_time} seconds\n')
+BaselineEnergyConsumption_DieselTruck = [result['Baseline (Diesel Truck)'] for result in results]
+BaselineEnergyConsumption_ElecTruck = [result['Baseline (EV Truck)'] for result in results]
+BaselineEnergyConsumption_ElecVan = [result['Baseline (EV Van)'] for result in results]
+HybridEnergyConsumption_DieselTruck = [result['Hybrid (Diesel Truck)'] for result in results]
+HybridEnergyConsumption_ElecTruck = [result['Hybrid (EV Truck)'] for result in results]
+HybridEnergyConsumption_ElecVan = [result['Hybrid (EV Van)'] for result in results]
+UAV_energy_DF = results[-1]['UAV_energy_DF']
 
 
 
@@ -286,11 +284,11 @@ for iterationno in range(MonteCarloInstances):
 # Display Simulation Result
 
 if MonteCarloIndicator == 0 and DisplayIntermediateDataFrame == True:
-    print('_' * os.get_terminal_size().columns)
+    print('_' * shutil.get_terminal_size().columns)
     print('[LAST MILE DILIVERY TOUR SOLUTION]')
     print(UAV_energy_DF)
 
-print('_' * os.get_terminal_size().columns)
+print('_' * shutil.get_terminal_size().columns)
 print('[RESULT]')
 
 end_time = time.time()
@@ -308,6 +306,12 @@ print('\nEnergy consumptions of Hybrid Delivery and Conventional Delivery Baseli
 print('BASELINE:', round(np.average(BaselineEnergyConsumption_ElecVan), 4))
 print('HYBRID:', round(np.average(HybridEnergyConsumption_ElecVan), 4))
 
+if stopping_rule is not None:
+    stopping_rule.should_stop()
+    print(f'\nStopped after {stopping_rule.n} instances ({stopping_rule.reason or "all instances run"}).')
+    print(f'Energy savings of Hybrid Delivery over the Baseline (kWh), {Confidence:.0%} confidence intervals:')
+    print(stopping_rule.intervals().to_string())
+
 
 #____________________________________________________________
 # Save Simulation Result
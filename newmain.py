@@ -11,6 +11,7 @@ import datetime
 import time
 import math
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 
 from parseCSV import *
@@ -26,13 +27,39 @@ from solve_mfstsp_heuristic import *
 
 import distance_functions
 
-from addon_HaversineFunction import haversine # [IMPORT HAVERSINE MODULE]
+from addon_HaversineFunction import haversine, haversine_array # [IMPORT HAVERSINE MODULE]
 
 # =============================================================
 startTime = time.time()
 
 METERS_PER_MILE = 1609.34
 
+# Columns of the assignment table written to the solution summary
+ASSIGNMENT_COLUMNS = ['vehicleID', 'vehicleType', 'activityType', 'startTime', 'startNode', 'endTime', 'endNode', 'Description', 'Status']
+
+# Labels of the heuristic's activity types and Gantt states
+STATUS_LABELS = {
+    TRAVEL_UAV_PACKAGE: 'UAV travels with parcel',
+    TRAVEL_UAV_EMPTY: 'UAV travels empty',
+    TRAVEL_TRUCK_W_UAV: 'Truck travels with UAV(s) on board',
+    TRAVEL_TRUCK_EMPTY: 'Truck travels with no UAVs on board',
+    VERTICAL_UAV_EMPTY: 'UAV taking off or landing with no parcels',
+    VERTICAL_UAV_PACKAGE: 'UAV taking off or landing with a parcel',
+    STATIONARY_UAV_EMPTY: 'UAV is stationary without a parcel',
+    STATIONARY_UAV_PACKAGE: 'UAV is stationary with a parcel',
+    STATIONARY_TRUCK_W_UAV: 'Truck is stationary with UAV(s) on board',
+    STATIONARY_TRUCK_EMPTY: 'Truck is stationary with no UAVs on board',
+}
+
+GANTT_LABELS = {
+    GANTT_IDLE: 'Idle',
+    GANTT_TRAVEL: 'Traveling',
+    GANTT_DELIVER: 'Making Delivery',
+    GANTT_RECOVER: 'UAV Recovery',
+    GANTT_LAUNCH: 'UAV Launch',
+    GANTT_FINISHED: 'Vehicle Tasks Complete',
+}
+
 # PROBLEM_TYPE
 # 1 --> mFSTSP optimal
 # 2 --> mFSTSP heuristic (will need other parameters)
@@ -67,6 +94,8 @@ def make_dict():
     # tau[v][i][j] = 44
 
 class make_node:
+    __slots__ = ('nodeType', 'latDeg', 'lonDeg', 'altMeters', 'parcelWtLbs', 'serviceTimeTruck', 'serviceTimeUAV', 'address')
+
     def __init__(self, nodeType, latDeg, lonDeg, altMeters, parcelWtLbs, serviceTimeTruck, serviceTimeUAV, address):
         # Set node[nodeID]
         self.nodeType             = nodeType
@@ -79,6 +108,8 @@ class make_node:
         self.address             = address            # Might be None
 
 class make_vehicle:
+    __slots__ = ('vehicleType', 'takeoffSpeed', 'cruiseSpeed', 'landingSpeed', 'yawRateDeg', 'cruiseAlt', 'capacityLbs', 'launchTime', 'recoveryTime', 'serviceTime', 'batteryPower', 'flightRange')
+
     def __init__(self, vehicleType, takeoffSpeed, cruiseSpeed, landingSpeed, yawRateDeg, cruiseAlt, capacityLbs, launchTime, recoveryTime, serviceTime, batteryPower, flightRange):
         # Set vehicle[vehicleID]
         self.vehicleType    = vehicleType
@@ -94,7 +125,11 @@ class make_vehicle:
         self.batteryPower    = batteryPower    # [joules].
         self.flightRange    = flightRange    # 'high' or 'low'
 
+TRAVEL_FIELDS = ('takeoffTime', 'flyTime', 'landTime', 'totalTime', 'takeoffDistance', 'flyDistance', 'landDistance', 'totalDistance')
+
 class make_travel:
+    __slots__ = TRAVEL_FIELDS
+
     def __init__(self, takeoffTime, flyTime, landTime, totalTime, takeoffDistance, flyDistance, landDistance, totalDistance):
         # Set travel[vehicleID][fromID][toID]
         self.takeoffTime      = takeoffTime
@@ -106,13 +141,95 @@ class make_travel:
         self.landDistance     = landDistance
         self.totalDistance     = totalDistance
 
+class make_travel_data:
+    # (n x n x 8) array of TRAVEL_FIELDS, shared by every vehicle with the same performance
+    # row(i) returns {j: make_travel}, built the first time it is needed and then shared by all of those vehicles
+    def __init__(self, nodeIDs, data):
+        self.nodeIDs = list(nodeIDs)
+        self.index = {nodeID: k for k, nodeID in enumerate(self.nodeIDs)}
+        self.data = data
+        self.rows = {}
+
+    def row(self, i):
+        if i not in self.rows:
+            self.rows[i] = dict(zip(self.nodeIDs, (make_travel(*values) for values in self.data[self.index[i]].tolist())))
+        return self.rows[i]
+
+class make_travel_table(dict):
+    # travel[vehicleID] over a make_travel_data
+    # Row i is a copy of the shared row (the make_travel records themselves are not copied) made the first time it is read,
+    # so travel[v][i][j] is a plain dict lookup and assignments by the solver stay in this vehicle's rows
+    # Like the defaultdict it replaces, reading a row that is not a node creates an empty one
+    def __init__(self, travelData):
+        super().__init__()
+        self.travelData = travelData
+        self.nodeIDs = travelData.nodeIDs
+        self.index = travelData.index
+
+    def __missing__(self, i):
+        row = defaultdict(make_dict)
+        if i in self.index:
+            row.update(self.travelData.row(i))
+        self[i] = row
+        return row
+
+    def _build(self):
+        # Iterating the table visits every node, so build the rows not read yet
+        for i in self.nodeIDs:
+            if not dict.__contains__(self, i):
+                self.__missing__(i)
+
+    def __contains__(self, i):
+        return dict.__contains__(self, i) or i in self.index
+
+    def get(self, i, default=None):
+        return self[i] if i in self else default
+
+    def __iter__(self):
+        self._build()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._build()
+        return dict.__len__(self)
+
+    def keys(self):
+        self._build()
+        return dict.keys(self)
+
+    def values(self):
+        self._build()
+        return dict.values(self)
+
+    def items(self):
+        self._build()
+        return dict.items(self)
+
+def calcUAVTravelData(node, vehicle):
+    # (n x n x 8) array of TRAVEL_FIELDS between all nodes for one UAV performance profile
+    nodeIDs = list(node)
+    data = np.zeros((len(nodeIDs), len(nodeIDs), len(TRAVEL_FIELDS)))
+    for a, i in enumerate(nodeIDs):
+        for b, j in enumerate(nodeIDs):
+            if (j != i):
+                data[a, b] = distance_functions.calcMultirotorTravelTime(vehicle.takeoffSpeed, vehicle.cruiseSpeed, vehicle.landingSpeed, vehicle.yawRateDeg, node[i].altMeters, vehicle.cruiseAlt, node[j].altMeters, node[i].latDeg, node[i].lonDeg, node[j].latDeg, node[j].lonDeg, -361, -361)
+    return data
+
+def calcTruckTravelData(numNodes, index, truckTime, truckDist):
+    # (n x n x 8) array of TRAVEL_FIELDS for the truck, packed like the UAV tables:
+    # travel[truckID][i][j] = make_travel(0.0, truckTime, 0.0, truckTime, 0.0, truckDist, 0.0, truckDist)
+    data = np.zeros((numNodes, numNodes, len(TRAVEL_FIELDS)))
+    for field, values in (('flyTime', truckTime), ('totalTime', truckTime), ('flyDistance', truckDist), ('totalDistance', truckDist)):
+        data[index + (TRAVEL_FIELDS.index(field),)] = values
+    return data
+
 class missionControl():
     # [LINE 140-304: MODIFIED INITIATOR TO ACCOMODATE CUSTOM PROBLEM AND SET PARAMETERS]
-    def __init__(self):
+    def __init__(self, problemName='myproblem', problem=None):
+        # problem: an addon_ProblemData.ProblemData to solve in place of the CSV files in Problems/<problemName>
 
         timestamp = datetime.datetime.strftime(datetime.datetime.now(), '%Y-%m-%d %H:%M:%S')
 
-        problemName         = 'myproblem'
         vehicleFileID        = int(999)
         cutoffTime             = float(60)
         problemType         = int(2) # Heuristic solution
@@ -128,6 +245,8 @@ class missionControl():
         indicator = 'Heuristic'
         self.solutionSummaryFile = 'Problems/%s/tbl_solutions_%d_%d_%s.csv' % (problemName, vehicleFileID, numUAVs, indicator)
         self.distmatrixFile = 'Problems/%s/tbl_truck_travel_data_PG.csv' % (problemName)
+        if problem is not None:
+            self.vehiclesFile = problem.vehiclesFile
 
         # Define data structures
         self.node = {}
@@ -135,22 +254,22 @@ class missionControl():
         self.travel = defaultdict(make_dict)
 
         # Read data for node locations, vehicle properties, and travel time matrix of truck:
-        self.readData(numUAVs)
+        self.readData(numUAVs, problem)
 
         # Calculate travel times of UAVs (travel times of truck has already been read when we called the readData function)
         # NOTE:  For each vehicle we're going to get a matrix of travel times from i to j,
         #         where i is in [0, # of customers] and j is in [0, # of customers].
         #         However, tau and tauPrime let node c+1 represent a copy of the depot.
+        #         UAVs with identical speeds and altitude share one table, computed once.
+        travelData = {}
         for vehicleID in self.vehicle:
             if (self.vehicle[vehicleID].vehicleType == TYPE_UAV):
                 # We have a UAV (Note:  In some problems we only have a truck)
-                for i in self.node:
-                    for j in self.node:
-                        if (j == i):
-                            self.travel[vehicleID][i][j] = make_travel(0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
-                        else:
-                            [takeoffTime, flyTime, landTime, totalTime, takeoffDistance, flyDistance, landDistance, totalDistance] = distance_functions.calcMultirotorTravelTime(self.vehicle[vehicleID].takeoffSpeed, self.vehicle[vehicleID].cruiseSpeed, self.vehicle[vehicleID].landingSpeed, self.vehicle[vehicleID].yawRateDeg, self.node[i].altMeters, self.vehicle[vehicleID].cruiseAlt, self.node[j].altMeters, self.node[i].latDeg, self.node[i].lonDeg, self.node[j].latDeg, self.node[j].lonDeg, -361, -361)
-                            self.travel[vehicleID][i][j] = make_travel(takeoffTime, flyTime, landTime, totalTime, takeoffDistance, flyDistance, landDistance, totalDistance)
+                vehicle = self.vehicle[vehicleID]
+                profile = (vehicle.takeoffSpeed, vehicle.cruiseSpeed, vehicle.landingSpeed, vehicle.yawRateDeg, vehicle.cruiseAlt)
+                if profile not in travelData:
+                    travelData[profile] = make_travel_data(self.node, calcUAVTravelData(self.node, vehicle))
+                self.travel[vehicleID] = make_travel_table(travelData[profile])
 
 
         # Now, call the IP / Heuristic model:
@@ -171,6 +290,7 @@ class missionControl():
                     numTruckCust    += 1
 
         # Write in the solution file:
+        os.makedirs(os.path.dirname(self.solutionSummaryFile), exist_ok=True)
         myFile = open(self.solutionSummaryFile, 'a')
         myFile.write('problemName, vehicleFileID, cutoffTime, problemTypeString, numUAVs, numTrucks, requireTruckAtDepot, requireDriver, Etype, ITER \n')
         str = '%s, %d, %f, %s, %d, %d, %s, %s, %d, %d \n\n' % (problemName, vehicleFileID, cutoffTime, problemTypeString[problemType], numUAVs, numTrucks, requireTruckAtDepot, requireDriver, Etype, ITER)
@@ -181,62 +301,37 @@ class missionControl():
 
         myFile.close()
 
-        # Create a dataframe to sort assignments according to their start times:
-        assignDF = pd.DataFrame(columns=['vehicleID', 'vehicleType', 'activityType', 'startTime', 'startNode', 'endTime', 'endNode', 'Description', 'Status'])
-        indexDF = 1
+        # Collect the assignments column by column and build the dataframe in one step:
+        assignColumns = {column: [] for column in ASSIGNMENT_COLUMNS}
 
         for v in assignments:
             for statusID in assignments[v]:
                 for statusIndex in assignments[v][statusID]:
-                    if (assignments[v][statusID][statusIndex].vehicleType == TYPE_TRUCK):
-                        vehicleType = 'Truck'
-                    else:
-                        vehicleType = 'UAV'
-                    if (statusID == TRAVEL_UAV_PACKAGE):
-                        status = 'UAV travels with parcel'
-                    elif (statusID == TRAVEL_UAV_EMPTY):
-                        status = 'UAV travels empty'
-                    elif (statusID == TRAVEL_TRUCK_W_UAV):
-                        status = 'Truck travels with UAV(s) on board'
-                    elif (statusID == TRAVEL_TRUCK_EMPTY):
-                        status = 'Truck travels with no UAVs on board'
-                    elif (statusID == VERTICAL_UAV_EMPTY):
-                        status = 'UAV taking off or landing with no parcels'
-                    elif (statusID == VERTICAL_UAV_PACKAGE):
-                        status = 'UAV taking off or landing with a parcel'
-                    elif (statusID == STATIONARY_UAV_EMPTY):
-                        status = 'UAV is stationary without a parcel'
-                    elif (statusID == STATIONARY_UAV_PACKAGE):
-                        status = 'UAV is stationary with a parcel'
-                    elif (statusID == STATIONARY_TRUCK_W_UAV):
-                        status = 'Truck is stationary with UAV(s) on board'
-                    elif (statusID == STATIONARY_TRUCK_EMPTY):
-                        status = 'Truck is stationary with no UAVs on board'
-                    else:
+                    assignment = assignments[v][statusID][statusIndex]
+                    if (statusID not in STATUS_LABELS):
                         print('UNKNOWN statusID.')
                         quit()
-
-                    
-                    if (assignments[v][statusID][statusIndex].ganttStatus == GANTT_IDLE):
-                        ganttStr = 'Idle'
-                    elif (assignments[v][statusID][statusIndex].ganttStatus == GANTT_TRAVEL):
-                        ganttStr = 'Traveling'
-                    elif (assignments[v][statusID][statusIndex].ganttStatus == GANTT_DELIVER):
-                        ganttStr = 'Making Delivery'
-                    elif (assignments[v][statusID][statusIndex].ganttStatus == GANTT_RECOVER):
-                        ganttStr = 'UAV Recovery'
-                    elif (assignments[v][statusID][statusIndex].ganttStatus == GANTT_LAUNCH):
-                        ganttStr = 'UAV Launch'
-                    elif (assignments[v][statusID][statusIndex].ganttStatus == GANTT_FINISHED):
-                        ganttStr = 'Vehicle Tasks Complete'
-                    else:
+                    if (assignment.ganttStatus not in GANTT_LABELS):
                         print('UNKNOWN ganttStatus')
                         quit()
-                    
-                    assignDF.loc[indexDF] = [v, vehicleType, status, assignments[v][statusID][statusIndex].startTime, assignments[v][statusID][statusIndex].startNodeID, assignments[v][statusID][statusIndex].endTime, assignments[v][statusID][statusIndex].endNodeID, assignments[v][statusID][statusIndex].description, ganttStr]
-                    indexDF += 1
 
-        assignDF = assignDF.sort_values(by=['startTime'])
+                    assignColumns['vehicleID'].append(v)
+                    assignColumns['vehicleType'].append('Truck' if assignment.vehicleType == TYPE_TRUCK else 'UAV')
+                    assignColumns['activityType'].append(STATUS_LABELS[statusID])
+                    assignColumns['startTime'].append(assignment.startTime)
+                    assignColumns['startNode'].append(assignment.startNodeID)
+                    assignColumns['endTime'].append(assignment.endTime)
+                    assignColumns['endNode'].append(assignment.endNodeID)
+                    assignColumns['Description'].append(assignment.description)
+                    assignColumns['Status'].append(GANTT_LABELS[assignment.ganttStatus])
+
+        # Rows are numbered from 1, as they were when appended one at a time
+        assignDF = pd.DataFrame(assignColumns, columns=ASSIGNMENT_COLUMNS, index=pd.RangeIndex(1, len(assignColumns['vehicleID']) + 1))
+        assignDF['vehicleType'] = pd.Categorical(assignDF['vehicleType'], categories=['Truck', 'UAV'])
+        assignDF['activityType'] = pd.Categorical(assignDF['activityType'], categories=list(STATUS_LABELS.values()))
+        assignDF['Status'] = pd.Categorical(assignDF['Status'], categories=list(GANTT_LABELS.values()))
+
+        assignDF = assignDF.sort_values(by=['startTime'], kind='stable')
 
         # Add this assignment dataframe to the solution file:
         assignDF.to_csv(self.solutionSummaryFile, mode='a', header=True, index=False)
@@ -245,24 +340,23 @@ class missionControl():
         solutionDF.reset_index(inplace = True, drop = True)
 
         # Adding Shortest distance to each travel in solution DF
-        nodesDF = pd.read_csv('Problems/%s/tbl_locations.csv' % (problemName))
+        if problem is not None:
+            nodesDF = problem.nodes_DF()
+        else:
+            nodesDF = pd.read_csv('Problems/%s/tbl_locations.csv' % (problemName))
         nodesDF.columns = pd.Series(colname.strip() for colname in nodesDF.columns)
-        coord_s = pd.Series([(nodesDF['latDeg'][i], nodesDF['lonDeg'][i]) for i in range(len(nodesDF))])
-        nodesDF['coord'] = coord_s
-        for nodeno in range(len(solutionDF['endNode'])):
-            if solutionDF.iloc[nodeno, 3] > nodesDF.iloc[-1,0]:
-                solutionDF.iloc[nodeno, 3] = nodesDF.iloc[0,1]
-        havdist_s = pd.Series(
-            [haversine(
-                nodesDF['coord'][solutionDF['startNode'][i]],
-                nodesDF['coord'][solutionDF['endNode'][i]]
-                ) for i in range(len(solutionDF)-1)]
-            )
-        havdist_s.loc[havdist_s.index.max()+1] = haversine(
-            nodesDF['coord'][solutionDF['startNode'][len(solutionDF)-1]],
-            nodesDF['coord'][0]
-            )
-        solutionDF['euclid_dist'] = havdist_s # shortest distance in km
+        nodesDF['coord'] = list(zip(nodesDF['latDeg'], nodesDF['lonDeg']))
+        # The copy of the depot (node c+1) is the depot itself
+        solutionDF.loc[solutionDF['endNode'] > nodesDF.iloc[-1,0], 'endNode'] = nodesDF.iloc[0,1]
+        startNodes = solutionDF['startNode'].to_numpy(dtype=int)
+        endNodes = solutionDF['endNode'].to_numpy(dtype=int).copy()
+        endNodes[-1:] = 0 # the last travel is measured back to the depot
+        latDeg = nodesDF['latDeg'].to_numpy()
+        lonDeg = nodesDF['lonDeg'].to_numpy()
+        solutionDF['euclid_dist'] = haversine_array(
+            latDeg[startNodes], lonDeg[startNodes],
+            latDeg[endNodes], lonDeg[endNodes]
+            ) # shortest distance in km
         UAVtravelDF = solutionDF[solutionDF.vehicleType == 'UAV'][['startNode', 'endNode', 'euclid_dist', 'Description']]
         UAVtravelDF.reset_index(inplace = True, drop = True)
         trucktravelDF = solutionDF[solutionDF.vehicleType == 'Truck'][['startNode', 'endNode', 'Description']]
@@ -288,8 +382,9 @@ class missionControl():
     # missionControl().return_UAV_DF() to call as output
 
     def return_UAV_INFO_DF(self):
-        df = pd.read_csv(self.vehiclesFile, skiprows=[0])
-        return df
+        if not hasattr(self, 'UAV_INFO_DF'):
+            self.UAV_INFO_DF = pd.read_csv(self.vehiclesFile, skiprows=[0])
+        return self.UAV_INFO_DF
     # missionControl().return_UAV_INFO_DF() to call as output
 
     def return_UAV_no(self):
@@ -300,10 +395,24 @@ class missionControl():
         return self.Truck_DF
     # missionControl().return_Truck_DF() to call as output
 
-    def readData(self, numUAVs):
+    def return_solution(self):
+        # All solution frames of this single heuristic run
+        return {
+            'nodes_DF': self.return_nodes_DF(),
+            'sol_DF': self.return_sol_DF(),
+            'UAV_DF': self.return_UAV_DF(),
+            'Truck_DF': self.return_Truck_DF(),
+            'UAV_INFO_DF': self.return_UAV_INFO_DF(),
+        }
+    # mission = missionControl(); mission.return_solution() to solve once and fetch every output
+
+    def readData(self, numUAVs, problem=None):
         # b)  tbl_vehicles.csv
         tmpUAVs = 0
-        rawData = parseCSVstring(self.vehiclesFile, returnJagged=False, fillerValue=-1, delimiter=',', commentChar='%')
+        if problem is not None:
+            rawData = problem.vehicle_rows()
+        else:
+            rawData = parseCSVstring(self.vehiclesFile, returnJagged=False, fillerValue=-1, delimiter=',', commentChar='%')
         for i in range(0,len(rawData)):
             vehicleID             = int(rawData[i][0])
             vehicleType            = int(rawData[i][1])
@@ -331,7 +440,10 @@ class missionControl():
             print("\t We'll solve the problem with %d UAVs.  Sorry." % (tmpUAVs))
 
         # a)  tbl_locations.csv
-        rawData = parseCSVstring(self.locationsFile, returnJagged=False, fillerValue=-1, delimiter=',', commentChar='%')
+        if problem is not None:
+            rawData = problem.location_rows()
+        else:
+            rawData = parseCSVstring(self.locationsFile, returnJagged=False, fillerValue=-1, delimiter=',', commentChar='%')
         for i in range(0,len(rawData)):
             nodeID                 = int(rawData[i][0])
             nodeType            = int(rawData[i][1])
@@ -357,18 +469,28 @@ class missionControl():
             self.node[nodeID] = make_node(nodeType, latDeg, lonDeg, altMeters, parcelWtLbs, serviceTimeTruck, serviceTimeUAV, address)
 
         # c) tbl_truck_travel_data.csv
-        if (os.path.isfile(self.distmatrixFile)):
-            # Travel matrix file exists
-            rawData = parseCSV(self.distmatrixFile, returnJagged=False, fillerValue=-1, delimiter=',')
-            for i in range(0,len(rawData)):
-                tmpi     = int(rawData[i][0])
-                tmpj     = int(rawData[i][1])
-                tmpTime    = float(rawData[i][2])
-                tmpDist    = float(rawData[i][3])
-
-                for vehicleID in self.vehicle:
-                    if (self.vehicle[vehicleID].vehicleType == TYPE_TRUCK):
-                        self.travel[vehicleID][tmpi][tmpj] = make_travel(0.0, tmpTime, 0.0, tmpTime, 0.0, tmpDist, 0.0, tmpDist)
+        if (problem is not None) or (os.path.isfile(self.distmatrixFile)):
+            if problem is not None:
+                # In-memory problem: the (n x n) matrices are already ordered like problem.nodeID
+                nodeIDs = problem.nodeID.tolist()
+                truckData = calcTruckTravelData(len(nodeIDs), (slice(None), slice(None)), problem.truck_time, problem.truck_dist)
+            else:
+                # Travel matrix file exists
+                rawData = parseCSV(self.distmatrixFile, returnJagged=False, fillerValue=-1, delimiter=',')
+                rawData = np.array(rawData, dtype=float)[:, :4].reshape(-1, 4)
+                tmpi     = rawData[:, 0].astype(int)
+                tmpj     = rawData[:, 1].astype(int)
+                tmpTime    = rawData[:, 2]
+                tmpDist    = rawData[:, 3]
+
+                nodeIDs = sorted(set(tmpi.tolist()) | set(tmpj.tolist()))
+                index = np.searchsorted(nodeIDs, tmpi), np.searchsorted(nodeIDs, tmpj)
+                truckData = calcTruckTravelData(len(nodeIDs), index, tmpTime, tmpDist)
+
+            truckTravelData = make_travel_data(nodeIDs, truckData)
+            for vehicleID in self.vehicle:
+                if (self.vehicle[vehicleID].vehicleType == TYPE_TRUCK):
+                    self.travel[vehicleID] = make_travel_table(truckTravelData)
 
         else:
             # Travel matrix file does not exist